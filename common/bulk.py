@@ -0,0 +1,260 @@
+"""Bounded fan-out of vCenter tasks
+
+Starting a task is a short blocking SOAP call, waiting for it is not done
+by a thread but by the session's task.TaskWatcher. A few submitter threads
+and a semaphore bounding the tasks in flight are therefore enough to drive
+hundreds of concurrent operations.
+"""
+
+import threading
+import time
+import threadpool
+from pyVmomi import vim
+import limiter
+import task
+
+
+# State of items not started because an item they depend on failed
+SKIPPED = 'skipped'
+
+
+class BulkResult(object):
+    """Outcome of the operation on one item"""
+
+    def __init__(self, item):
+        self.item = item
+        self.state = None
+        # Task fault or exception raised while starting the task
+        self.error = None
+        # Seconds from start to completion
+        self.elapsed = None
+        self.start_time = None
+        # Whether vCenter queued the task before running it
+        self.queued = False
+
+    def ok(self):
+        return self.state == vim.TaskInfo.State.success
+
+
+def get_slots(limit):
+    if isinstance(limit, limiter.AdaptiveLimiter):
+        return limit
+    return limiter.get_limiter(limit)
+
+
+def run_tasks(si, items, submit, limit=50, workers=4, on_done=None):
+    """Starts one task per item and waits for all of them.
+
+    @param si: vim.ServiceInstance the tasks belong to
+    @param items: items to operate on
+    @param submit: callable(item) starting the operation and returning its
+    vim.Task, or None when there is nothing to do for the item
+    @param limit: maximum number of tasks in flight, or a
+    limiter.AdaptiveLimiter adapting it
+    @param workers: number of threads making the blocking submit calls
+    @param on_done: optional callable(BulkResult) called once an item is done
+    @return list of BulkResult in the order of items
+    """
+    results = [BulkResult(item) for item in items]
+    if not results:
+        return results
+    watcher = task.GetTaskWatcher(si)
+    slots = get_slots(limit)
+    lock = threading.Lock()
+    all_done = threading.Event()
+    pending = [len(results)]
+
+    def complete(result, timed=True):
+        result.elapsed = time.time() - result.start_time
+        slots.release(result.elapsed if timed else None, result.error,
+                      result.queued)
+        if on_done:
+            on_done(result)
+        with lock:
+            pending[0] -= 1
+            if pending[0] == 0:
+                all_done.set()
+
+    def on_task_done(result, future):
+        result.state = future.state
+        result.error = future.exception or future.error
+        result.queued = future.queued
+        complete(result)
+
+    def start(result):
+        slots.acquire()
+        result.start_time = time.time()
+        try:
+            vim_task = submit(result.item)
+            if vim_task is None:
+                result.state = vim.TaskInfo.State.success
+                complete(result, timed=False)
+                return
+            future = watcher.Watch(vim_task)
+        except Exception as e:
+            result.state = vim.TaskInfo.State.error
+            result.error = e
+            complete(result)
+            return
+        future.AddDoneCallback(lambda f: on_task_done(result, f))
+
+    pool_size = min(workers, len(results))
+    pool = threadpool.ThreadPool(pool_size)
+    for result in results:
+        pool.putRequest(threadpool.WorkRequest(start, args=(result,)))
+    pool.wait()
+    # Idle workers only notice the dismissal when their queue poll times
+    # out, the requests are all done so they are not waited for
+    pool.dismissWorkers(pool_size)
+    all_done.wait()
+    return results
+
+
+def run_task_graph(si, items, deps, submit, limit=50, workers=4,
+                   on_done=None):
+    """Like run_tasks, but starts the task of an item only once the tasks
+    of all the items it depends on succeeded.
+
+    Items whose dependency failed or was skipped are skipped in turn.
+    @param deps: dict item -> list of items that must be done first,
+    items not in items are ignored
+    @return list of BulkResult in the order of items
+    """
+    results = [BulkResult(item) for item in items]
+    if not results:
+        return results
+    by_id = dict((id(result.item), result) for result in results)
+    waiting = dict((id(result.item),
+                    set(id(dep) for dep in deps.get(result.item, [])
+                        if id(dep) in by_id))
+                   for result in results)
+    dependents = dict((key, []) for key in by_id)
+    for key, dep_keys in waiting.items():
+        for dep_key in dep_keys:
+            dependents[dep_key].append(key)
+    watcher = task.GetTaskWatcher(si)
+    slots = get_slots(limit)
+    lock = threading.Lock()
+    all_done = threading.Event()
+    pending = [len(results)]
+    # Items started or skipped, guarded by lock
+    claimed = set()
+    pool_size = min(workers, len(results))
+    pool = threadpool.ThreadPool(pool_size)
+
+    def claim(result):
+        with lock:
+            if id(result.item) in claimed:
+                return False
+            claimed.add(id(result.item))
+            return True
+
+    def finish(result):
+        if on_done:
+            on_done(result)
+        with lock:
+            pending[0] -= 1
+            if pending[0] == 0:
+                all_done.set()
+
+    def skip_dependents(result):
+        for key in dependents[id(result.item)]:
+            other = by_id[key]
+            if claim(other):
+                other.state = SKIPPED
+                other.error = 'depends on {}'.format(result.item.name())
+                finish(other)
+                skip_dependents(other)
+
+    def complete(result, timed=True):
+        result.elapsed = time.time() - result.start_time
+        slots.release(result.elapsed if timed else None, result.error,
+                      result.queued)
+        finish(result)
+        if not result.ok():
+            skip_dependents(result)
+            return
+        ready = []
+        with lock:
+            for key in dependents[id(result.item)]:
+                waiting[key].discard(id(result.item))
+                if not waiting[key]:
+                    ready.append(by_id[key])
+        for other in ready:
+            pool.putRequest(threadpool.WorkRequest(start, args=(other,)))
+
+    def on_task_done(result, future):
+        result.state = future.state
+        result.error = future.exception or future.error
+        result.queued = future.queued
+        complete(result)
+
+    def start(result):
+        if not claim(result):
+            return
+        slots.acquire()
+        result.start_time = time.time()
+        try:
+            vim_task = submit(result.item)
+            if vim_task is None:
+                result.state = vim.TaskInfo.State.success
+                complete(result, timed=False)
+                return
+            future = watcher.Watch(vim_task)
+        except Exception as e:
+            result.state = vim.TaskInfo.State.error
+            result.error = e
+            complete(result)
+            return
+        future.AddDoneCallback(lambda f: on_task_done(result, f))
+
+    for result in results:
+        if not waiting[id(result.item)]:
+            pool.putRequest(threadpool.WorkRequest(start, args=(result,)))
+    # Requests are added from task callbacks, so wait for the items
+    # rather than for the pool
+    all_done.wait()
+    pool.dismissWorkers(pool_size)
+    return results
+
+
+def run_calls(items, func, concurrency=16, on_done=None):
+    """Calls func(item) for every item on a bounded thread pool.
+
+    Meant for blocking per item work that is not a single task, e.g. a
+    series of host configuration calls.
+    @param on_done: optional callable(BulkResult), called in this thread
+    @return list of BulkResult in the order of items
+    """
+    results = [BulkResult(item) for item in items]
+    if not results:
+        return results
+
+    def call(result):
+        result.start_time = time.time()
+        try:
+            func(result.item)
+        finally:
+            result.elapsed = time.time() - result.start_time
+
+    def done(request, _):
+        result = request.args[0]
+        result.state = vim.TaskInfo.State.success
+        if on_done:
+            on_done(result)
+
+    def failed(request, exc_info):
+        result = request.args[0]
+        result.state = vim.TaskInfo.State.error
+        result.error = exc_info[1]
+        if on_done:
+            on_done(result)
+
+    pool_size = min(concurrency, len(results))
+    pool = threadpool.ThreadPool(pool_size)
+    for result in results:
+        pool.putRequest(threadpool.WorkRequest(
+            call, args=(result,), callback=done, exc_callback=failed))
+    pool.wait()
+    pool.dismissWorkers(pool_size)
+    return results
@@ -0,0 +1,162 @@
+"""Dependency-aware cleanup of vms, networks and folders
+
+One snapshot gives the vms using each network and the children of each
+folder. A network is destroyed once the vms using it are gone and a
+folder once the vms below it are; networks and folders still holding
+objects that are not cleaned up are skipped instead of failing. A matching
+folder nested in another one that is destroyed goes with its subtree and
+is not destroyed on its own. Independent objects are destroyed
+concurrently.
+"""
+
+from pyVmomi import vim
+import bulk
+import inventory
+import vmwareapi
+
+SNAPSHOT_PATHS = [
+    (vim.VirtualMachine, ['name', 'runtime.powerState']),
+    (vim.Network, ['name', 'vm']),
+    (vim.Folder, ['name', 'childEntity']),
+]
+
+
+class CleanupGraph(object):
+    """Objects to destroy and what each must wait for"""
+
+    def __init__(self, vc, vm_keys_list=None, net_keys_list=None,
+                 folder_keys_list=None):
+        """
+        @param vc: VirtualCenter instance
+        @param vm_keys_list: regular expressions of the vm names
+        @param net_keys_list: regular expressions of the network names
+        @param folder_keys_list: regular expressions of the folder names
+        """
+        snapshot = vc.get_inventory_snapshot(SNAPSHOT_PATHS)
+        self.props = dict(snapshot)
+        self.parents = {}
+        for obj, props in snapshot:
+            for child in props.get('childEntity') or []:
+                self.parents[child] = obj
+        self.vms = [vmwareapi.VM(vc.si, vm, props) for vm, props
+                    in self._match(snapshot, vim.VirtualMachine,
+                                   vm_keys_list)]
+        self.nets = [vmwareapi.Network(vc.si, net, props) for net, props
+                     in self._match(snapshot, vim.Network, net_keys_list)]
+        self.folders = [vmwareapi.Folder(vc.si, folder, props)
+                        for folder, props
+                        in self._match(snapshot, vim.Folder,
+                                       folder_keys_list)]
+        # Objects that will not go away and why
+        self.in_use = []
+
+    def _ancestors(self, obj):
+        parent = self.parents.get(obj)
+        while parent is not None:
+            yield parent
+            parent = self.parents.get(parent)
+
+    def _match(self, snapshot, vimtype, regex_list):
+        return inventory.match_regex(
+            [(obj, props) for obj, props in snapshot
+             if isinstance(obj, vimtype)], regex_list or [])
+
+    def get_deps(self, vms):
+        """Returns the networks and folders that can be destroyed once
+        the given vms are, and what each depends on.
+
+        Networks used by other vms and folders holding anything but vms
+        and folders are recorded in in_use and left out. A folder below
+        another destroyable matched folder is left out as well, it goes
+        with the subtree of that folder.
+        @param vms: VM wrappers that will be destroyed
+        @return (list of wrappers, dict wrapper -> list of wrappers)
+        """
+        vm_by_obj = dict((vm.vm, vm) for vm in vms)
+        deps = {}
+        items = []
+        for net in self.nets:
+            users = net.props.get('vm') or []
+            kept = [vm for vm in users if vm not in vm_by_obj]
+            if kept:
+                self.in_use.append((net, 'used by vm {}'.format(
+                    self.props.get(kept[0], {}).get('name', kept[0]))))
+                continue
+            deps[net] = [vm_by_obj[vm] for vm in users]
+            items.append(net)
+        destroyable = {}
+        for folder in self.folders:
+            targets, kept = self._walk(folder.folder, vm_by_obj)
+            if kept:
+                self.in_use.append((folder, 'holds {}'.format(
+                    self.props.get(kept[0], {}).get('name', kept[0]))))
+                continue
+            destroyable[folder.folder] = targets
+        for folder in self.folders:
+            if folder.folder not in destroyable or \
+                    any(ancestor in destroyable
+                        for ancestor in self._ancestors(folder.folder)):
+                continue
+            deps[folder] = destroyable[folder.folder]
+            items.append(folder)
+        return items, deps
+
+    def _walk(self, folder, vm_by_obj):
+        """Returns the vms to destroy below a folder and the other objects
+        that would be destroyed with it.
+        """
+        targets = []
+        kept = []
+        for child in self.props.get(folder, {}).get('childEntity') or []:
+            if child in vm_by_obj:
+                targets.append(vm_by_obj[child])
+                continue
+            if isinstance(child, vim.Folder):
+                child_targets, child_kept = self._walk(child, vm_by_obj)
+                targets.extend(child_targets)
+                kept.extend(child_kept)
+            else:
+                kept.append(child)
+        return targets, kept
+
+
+def report(results, action='delete'):
+    """Prints the failed and skipped items and returns their number."""
+    count = 0
+    for result in results:
+        if result.state == bulk.SKIPPED:
+            print 'Skip {} {}: {}'.format(action, result.item.name(),
+                                           result.error)
+            count += 1
+        elif not result.ok():
+            print 'Failed to {} {}: {}'.format(
+                action, result.item.name(),
+                getattr(result.error, 'msg', result.error))
+            count += 1
+    return count
+
+
+def clean(vc, vm_keys_list=None, net_keys_list=None, folder_keys_list=None,
+          poweroff_limit=10, destroy_limit=10):
+    """Destroys the matching vms, networks and folders.
+
+    Matching vms are powered off together first. Then every vm, network
+    and folder is destroyed as soon as what it depends on is gone, at
+    most destroy_limit tasks at a time.
+    @return number of objects not cleaned up
+    """
+    graph = CleanupGraph(vc, vm_keys_list, net_keys_list, folder_keys_list)
+    powered_on = [vm for vm in graph.vms
+                  if vm.props.get('runtime.powerState') == 'poweredOn']
+    results = bulk.run_tasks(vc.si, powered_on,
+                             lambda vm: vm.poweroff_task(), poweroff_limit)
+    failures = report(results, 'power off')
+    still_on = set(id(result.item) for result in results if not result.ok())
+    vms = [vm for vm in graph.vms if id(vm) not in still_on]
+    items, deps = graph.get_deps(vms)
+    for obj, reason in graph.in_use:
+        print 'Skip delete {}: {}'.format(obj.name(), reason)
+    results = bulk.run_task_graph(vc.si, vms + items, deps,
+                                  lambda obj: obj.destroy_task(),
+                                  destroy_limit)
+    return failures + len(graph.in_use) + report(results)
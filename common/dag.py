@@ -0,0 +1,177 @@
+"""Dependency graph executor
+
+Runs steps on a bounded thread pool as soon as all the steps they depend
+on are done. A failed step is reported and every step depending on it,
+directly or not, is skipped.
+
+With a journal, completed steps are recorded and a resumed run only
+re-validates the steps journaled with unchanged inputs.
+"""
+
+import journal
+import threadpool
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Node(object):
+    """One step of the graph"""
+
+    def __init__(self, name, func, deps, args, kwargs, digest=None,
+                 check=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.digest = digest
+        self.check = check
+        self.state = PENDING
+        self.result = None
+        self.error = None
+
+
+class DagExecutor(object):
+
+    def __init__(self, concurrency=4, journal=None, resume=False):
+        """
+        @param journal: optional journal.Journal recording completed steps
+        @param resume: skip the steps the journal has with unchanged inputs
+        """
+        self.concurrency = max(concurrency, 1)
+        self.journal = journal
+        self.resume = resume
+        self.nodes = {}
+        self.order = []
+
+    def add(self, name, func, deps=(), args=(), kwargs=None, inputs=None,
+            check=None):
+        """Adds a step.
+
+        @param name: unique name of the step
+        @param func: callable running the step, its return value is kept
+        as the step result
+        @param deps: names of the steps that must be done first
+        @param inputs: list of (key, value) pairs the step is built from,
+        steps without inputs are not journaled
+        @param check: callable validating a journaled step on resume, it
+        returns the step result or None to run the step again; journaled
+        steps without check are skipped
+        """
+        if name in self.nodes:
+            raise ValueError('Step {} already defined'.format(name))
+        digest = None
+        if self.journal is not None and inputs is not None:
+            digest = journal.digest(
+                inputs, [self.nodes[dep].digest for dep in deps
+                         if dep in self.nodes])
+        self.nodes[name] = Node(name, func, deps, args, kwargs, digest,
+                                check)
+        self.order.append(name)
+
+    def has(self, name):
+        return name in self.nodes
+
+    def result(self, name):
+        return self.nodes[name].result
+
+    def _resume(self, node):
+        """Runs a step journaled as done, only validating it if possible"""
+        if node.check is None:
+            print 'Step {} done in a previous run, skipped.'.format(node.name)
+            return None
+        result = node.check()
+        if result is not None:
+            print 'Step {} done in a previous run.'.format(node.name)
+            return result
+        print 'Step {} no longer in place, run it again.'.format(node.name)
+        return node.func(*node.args, **node.kwargs)
+
+    def _check(self):
+        for name in self.order:
+            for dep in self.nodes[name].deps:
+                if dep not in self.nodes:
+                    raise ValueError(
+                        'Step {} depends on unknown step {}'.format(name, dep))
+        # Kahn's algorithm, every step must be reachable
+        remaining = dict((name, len(set(self.nodes[name].deps)))
+                         for name in self.order)
+        ready = [name for name in self.order if remaining[name] == 0]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for other in self.order:
+                if name in self.nodes[other].deps:
+                    remaining[other] -= 1
+                    if remaining[other] == 0:
+                        ready.append(other)
+        if visited != len(self.order):
+            raise ValueError('Steps have circular dependencies')
+
+    def run(self):
+        """Runs all steps and returns the nodes by name."""
+        self._check()
+        waiting = dict((name, set(self.nodes[name].deps))
+                       for name in self.order)
+        dependents = dict((name, []) for name in self.order)
+        for name in self.order:
+            for dep in set(self.nodes[name].deps):
+                dependents[dep].append(name)
+        pool = threadpool.ThreadPool(self.concurrency)
+
+        def submit(node):
+            if self.resume and self.journal.done(node.name, node.digest):
+                request = threadpool.WorkRequest(
+                    self._resume, args=(node,),
+                    callback=on_done, exc_callback=on_error)
+            else:
+                request = threadpool.WorkRequest(
+                    node.func, args=node.args, kwds=node.kwargs,
+                    callback=on_done, exc_callback=on_error)
+            request.node = node
+            pool.putRequest(request)
+
+        def skip(name):
+            for other in dependents[name]:
+                node = self.nodes[other]
+                if node.state == PENDING:
+                    node.state = SKIPPED
+                    print 'Skip step {}, step {} did not complete.'\
+                        .format(other, name)
+                    skip(other)
+
+        # Callbacks run in this thread while the pool is polled
+        def on_done(request, result):
+            node = request.node
+            node.state = DONE
+            node.result = result
+            if self.journal is not None and node.digest is not None:
+                self.journal.record(node.name, node.digest)
+            for other in dependents[node.name]:
+                waiting[other].discard(node.name)
+                if not waiting[other] and self.nodes[other].state == PENDING:
+                    submit(self.nodes[other])
+
+        def on_error(request, exc_info):
+            node = request.node
+            node.state = FAILED
+            node.error = exc_info[1]
+            print 'Step {} failed: {}'.format(node.name, node.error)
+            skip(node.name)
+
+        for name in self.order:
+            if not waiting[name]:
+                submit(self.nodes[name])
+        pool.wait()
+        # Every step is done, idle workers exit once their queue poll
+        # times out
+        pool.dismissWorkers(self.concurrency)
+        return self.nodes
+
+    def failed(self):
+        return [name for name in self.order
+                if self.nodes[name].state in (FAILED, SKIPPED)]
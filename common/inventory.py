@@ -0,0 +1,381 @@
+"""Bulk inventory retrieval helpers for pyVmomi
+
+Reading a property through a managed object reference (vm.name,
+vm.runtime.powerState, ...) costs one SOAP round trip per object. The
+helpers here fetch the requested properties of a whole container view
+with a single RetrievePropertiesEx call so filtering can be done locally.
+"""
+
+import re
+import threading
+import time
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+
+PC = vmodl.query.PropertyCollector
+
+
+def get_view_filter_spec(view, vimtype, path_set):
+    """Builds a filter spec selecting vimtype objects of a container view.
+
+    @param view: vim.view.ContainerView
+    @param vimtype: managed object type, e.g. vim.VirtualMachine
+    @param path_set: list of property paths to retrieve
+    @return vmodl.query.PropertyCollector.FilterSpec
+    """
+    traversal_spec = PC.TraversalSpec(
+        name='traverseView',
+        path='view',
+        skip=False,
+        type=vim.view.ContainerView)
+    obj_spec = PC.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec])
+    prop_spec = PC.PropertySpec(type=vimtype, pathSet=path_set, all=False)
+    return PC.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+
+
+def retrieve(si, filter_spec):
+    """Runs RetrievePropertiesEx and follows the continuation token.
+
+    @param si: vim.ServiceInstance
+    @param filter_spec: vmodl.query.PropertyCollector.FilterSpec
+    @return list of (managed object, property dict) tuples
+    """
+    pc = si.RetrieveContent().propertyCollector
+    result = pc.RetrievePropertiesEx([filter_spec], PC.RetrieveOptions())
+    snapshot = []
+    while result is not None:
+        for obj_content in result.objects:
+            props = dict((prop.name, prop.val)
+                         for prop in obj_content.propSet)
+            snapshot.append((obj_content.obj, props))
+        if not result.token:
+            break
+        result = pc.ContinueRetrievePropertiesEx(result.token)
+    return snapshot
+
+
+def collect_properties(si, view, vimtype, path_set=None):
+    """Fetches properties of every vimtype object in the view in one call.
+
+    @param si: vim.ServiceInstance
+    @param view: vim.view.ContainerView holding the objects
+    @param vimtype: managed object type, e.g. vim.VirtualMachine
+    @param path_set: list of property paths, ['name'] by default
+    @return list of (managed object, property dict) tuples
+    """
+    if path_set is None:
+        path_set = ['name']
+    return retrieve(si, get_view_filter_spec(view, vimtype, path_set))
+
+
+def collect_object_properties(si, objs, vimtype, path_set=None):
+    """Fetches properties of an explicit list of objects in one call.
+
+    @param si: vim.ServiceInstance
+    @param objs: list of managed objects of vimtype
+    @param vimtype: managed object type, e.g. vim.VirtualMachine
+    @param path_set: list of property paths, ['name'] by default
+    @return list of (managed object, property dict) tuples
+    """
+    if path_set is None:
+        path_set = ['name']
+    seen = set()
+    unique_objs = []
+    for obj in objs:
+        if obj not in seen:
+            seen.add(obj)
+            unique_objs.append(obj)
+    if not unique_objs:
+        return []
+    filter_spec = PC.FilterSpec(
+        objectSet=[PC.ObjectSpec(obj=obj) for obj in unique_objs],
+        propSet=[PC.PropertySpec(type=vimtype, pathSet=path_set, all=False)])
+    return retrieve(si, filter_spec)
+
+
+def collect_types(si, view, path_sets):
+    """Fetches properties of several object types of a view in one call.
+
+    @param si: vim.ServiceInstance
+    @param view: vim.view.ContainerView holding the objects
+    @param path_sets: list of (managed object type, property paths)
+    tuples; the paths of a type also apply to its subtypes
+    @return list of (managed object, property dict) tuples
+    """
+    filter_spec = get_view_filter_spec(view, path_sets[0][0],
+                                       path_sets[0][1])
+    filter_spec.propSet = [PC.PropertySpec(type=vimtype, pathSet=path_set,
+                                           all=False)
+                           for vimtype, path_set in path_sets]
+    return retrieve(si, filter_spec)
+
+
+def collect_related(si, obj, path, vimtype, path_set=None):
+    """Fetches properties of the objects a reference property of obj
+    points to, e.g. the portgroups of a DVS, in one call.
+
+    @param si: vim.ServiceInstance
+    @param obj: managed object holding the references
+    @param path: property of obj listing the objects, e.g. 'portgroup'
+    @param vimtype: managed object type of the referenced objects
+    @param path_set: list of property paths, ['name'] by default
+    @return list of (managed object, property dict) tuples
+    """
+    if path_set is None:
+        path_set = ['name']
+    traversal_spec = PC.TraversalSpec(
+        name='traverse' + path.capitalize(),
+        path=path,
+        skip=False,
+        type=type(obj))
+    obj_spec = PC.ObjectSpec(obj=obj, skip=True, selectSet=[traversal_spec])
+    prop_spec = PC.PropertySpec(type=vimtype, pathSet=path_set, all=False)
+    return retrieve(si, PC.FilterSpec(objectSet=[obj_spec],
+                                      propSet=[prop_spec]))
+
+
+class AnyMatcher(object):
+    """Matches a name against several expressions, one by one"""
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+
+    def match(self, name):
+        for pattern in self.patterns:
+            match = pattern.match(name)
+            if match:
+                return match
+        return None
+
+
+def compile_regex(regex_list):
+    """Compiles a list of regular expressions into one alternation.
+
+    The alternation keeps re.match semantics: a name matches when any of
+    the expressions matches at its start. Joining would renumber the
+    backreferences, clash the named groups and spread the inline flags of
+    the expressions, so when any of them has groups or flags an AnyMatcher
+    trying them one by one is returned instead.
+    """
+    patterns = [re.compile(regex) for regex in regex_list]
+    default_flags = re.compile('').flags
+    if any(pattern.groups or pattern.flags != default_flags
+           for pattern in patterns):
+        return AnyMatcher(patterns)
+    return re.compile('|'.join('(?:%s)' % regex for regex in regex_list))
+
+
+def match_regex(snapshot, regex_list, props_filter=None):
+    """Walks a snapshot once and keeps entries whose name matches.
+
+    @param snapshot: list of (managed object, property dict) tuples
+    @param regex_list: list of regular expressions for the name
+    @param props_filter: optional dict of property path to required value
+    @return list of unique (managed object, property dict) tuples
+    """
+    if not regex_list:
+        return []
+    matcher = compile_regex(regex_list)
+    props_filter = props_filter or {}
+    seen = set()
+    matched = []
+    for obj, props in snapshot:
+        if obj in seen or not matcher.match(props.get('name', '')):
+            continue
+        if any(props.get(path) != value
+               for path, value in props_filter.items()):
+            continue
+        seen.add(obj)
+        matched.append((obj, props))
+    return matched
+
+
+# Indexes and view managers registered per session, keyed by the stub of
+# the ServiceInstance so that wrappers holding only `si` can find them.
+_INDEXES = {}
+_VIEW_MANAGERS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class ViewManager(object):
+    """Creates and reuses container views of one session.
+
+    One recursive view is kept per (container, type set); views are
+    only released by destroy_all(), typically when disconnecting.
+    """
+
+    def __init__(self, si):
+        self.si = si
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def get_view(self, vimtypes, container=None):
+        """Returns the recursive container view for the given types.
+
+        @param vimtypes: list of managed object types
+        @param container: container managed entity, root folder by default
+        @return vim.view.ContainerView
+        """
+        if container is None:
+            container = self.si.RetrieveContent().rootFolder
+        key = (container._moId,
+               tuple(sorted(vimtype._wsdlName for vimtype in vimtypes)))
+        with self.lock:
+            view = self.views.get(key)
+            if view is None:
+                vmgr = self.si.RetrieveContent().viewManager
+                view = vmgr.CreateContainerView(container=container,
+                                                type=vimtypes,
+                                                recursive=True)
+                self.views[key] = view
+        return view
+
+    def count(self):
+        """Returns the number of views open on the server."""
+        return len(self.views)
+
+    def destroy_all(self):
+        with self.lock:
+            views = self.views.values()
+            self.views.clear()
+        for view in views:
+            view.DestroyView()
+
+
+def get_view_manager(si):
+    """Returns the view manager of the session, creating it on first use."""
+    with _REGISTRY_LOCK:
+        view_manager = _VIEW_MANAGERS.get(si._stub)
+        if view_manager is None:
+            view_manager = ViewManager(si)
+            _VIEW_MANAGERS[si._stub] = view_manager
+    return view_manager
+
+
+def release_views(si):
+    """Destroys every view of the session and forgets its manager."""
+    with _REGISTRY_LOCK:
+        view_manager = _VIEW_MANAGERS.pop(si._stub, None)
+    if view_manager is not None:
+        view_manager.destroy_all()
+
+
+def register_index(si, index):
+    _INDEXES[si._stub] = index
+
+
+def unregister_index(si):
+    return _INDEXES.pop(si._stub, None)
+
+
+def get_index(si):
+    return _INDEXES.get(si._stub)
+
+
+class InventoryIndex(object):
+    """Name to managed object index kept current by WaitForUpdatesEx.
+
+    The index owns a private PropertyCollector with one filter on the
+    name of every object in the view. It is built from the initial
+    update and afterwards only applies the incremental change sets, so
+    renamed objects are re-keyed and destroyed objects are evicted.
+    """
+
+    def __init__(self, si, view, vimtypes, max_age=5):
+        """
+        @param si: vim.ServiceInstance
+        @param view: vim.view.ContainerView holding the indexed objects
+        @param vimtypes: list of managed object types in the view
+        @param max_age: seconds a lookup hit may rely on without polling
+        """
+        self.si = si
+        self.vimtypes = vimtypes
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.version = ''
+        self.last_refresh = 0
+        self.names = {}
+        self.objs = {}
+        pc = si.RetrieveContent().propertyCollector
+        self.pc = pc.CreatePropertyCollector()
+        filter_spec = get_view_filter_spec(view, vimtypes[0], ['name'])
+        filter_spec.propSet = [PC.PropertySpec(type=vimtype,
+                                               pathSet=['name'],
+                                               all=False)
+                               for vimtype in vimtypes]
+        self.filter = self.pc.CreateFilter(filter_spec, True)
+        self.refresh()
+
+    def refresh(self):
+        """Applies pending updates without blocking on the server."""
+        options = PC.WaitOptions(maxWaitSeconds=0)
+        with self.lock:
+            while True:
+                update = self.pc.WaitForUpdatesEx(self.version, options)
+                if update is None:
+                    break
+                self._apply(update)
+                self.version = update.version
+                if not update.truncated:
+                    break
+            self.last_refresh = time.time()
+
+    def _apply(self, update):
+        for filter_set in update.filterSet:
+            for obj_update in filter_set.objectSet:
+                obj = obj_update.obj
+                if obj_update.kind == 'leave':
+                    self._evict(obj)
+                    continue
+                for change in obj_update.changeSet:
+                    if change.name != 'name':
+                        continue
+                    self._evict(obj)
+                    if change.op in ('add', 'assign'):
+                        self._add(obj, change.val)
+
+    def _add(self, obj, name):
+        self.objs[obj] = name
+        self.names.setdefault(name, []).append(obj)
+
+    def _evict(self, obj):
+        name = self.objs.pop(obj, None)
+        if name is None:
+            return
+        objs = self.names.get(name, [])
+        if obj in objs:
+            objs.remove(obj)
+        if not objs:
+            self.names.pop(name, None)
+
+    def covers(self, vimtypes):
+        """Returns whether every given type is indexed."""
+        return all(issubclass(vimtype, tuple(self.vimtypes))
+                   for vimtype in vimtypes)
+
+    def lookup(self, vimtypes, name):
+        """Returns the indexed objects of the given types named name.
+
+        A miss or an outdated index polls for updates before answering,
+        so objects created since the last poll are found. A hit is served
+        without polling when the last poll is less than max_age seconds
+        old: the object may have been destroyed or renamed since.
+        """
+        if time.time() - self.last_refresh > self.max_age:
+            self.refresh()
+        with self.lock:
+            objs = [obj for obj in self.names.get(name, [])
+                    if isinstance(obj, tuple(vimtypes))]
+        if not objs:
+            self.refresh()
+            with self.lock:
+                objs = [obj for obj in self.names.get(name, [])
+                        if isinstance(obj, tuple(vimtypes))]
+        return objs
+
+    def destroy(self):
+        self.filter.Destroy()
+        self.pc.DestroyPropertyCollector()
+        self.names.clear()
+        self.objs.clear()
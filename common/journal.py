@@ -0,0 +1,60 @@
+"""Journal of completed vc-cfg steps
+
+Each completed step is recorded with a digest of its inputs and of the
+digests of the steps it depends on, so editing a section invalidates the
+section and everything below it. A resumed run skips the steps whose
+digest is unchanged.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import utils
+
+
+def digest(inputs, dep_digests=()):
+    """Returns the digest of a step.
+
+    @param inputs: list of (key, value) pairs the step is built from
+    @param dep_digests: digests of the steps it depends on
+    """
+    data = json.dumps([sorted(inputs), sorted(d or '' for d in dep_digests)])
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_journal_path(config_path, vc_item):
+    """Returns the journal file of one vc_N subtree of a config file."""
+    config_id = hashlib.sha1(os.path.abspath(config_path)).hexdigest()
+    return os.path.join(utils.JOURNAL_DIR,
+                        '{}_{}.json'.format(config_id, vc_item))
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as journal_file:
+                self.steps = json.load(journal_file)
+        except (IOError, ValueError):
+            self.steps = {}
+
+    def done(self, name, step_digest):
+        return step_digest is not None and \
+            self.steps.get(name) == step_digest
+
+    def record(self, name, step_digest):
+        self.steps[name] = step_digest
+        self._save()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as journal_file:
+            json.dump(self.steps, journal_file, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
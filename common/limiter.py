@@ -0,0 +1,183 @@
+"""Adaptive concurrency limit for bulk operations
+
+The limit follows AIMD: after a window of `limit` healthy completions it
+grows by one, and it is multiplied by `backoff` when vCenter reports a
+task as queued, a throttling fault comes back, or the fault rate or the
+latency of a window is too high. At most one decrease happens per window,
+so the completions of tasks started under the old limit do not collapse
+it to the floor. Limit changes are logged at info level.
+"""
+
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# Faults vCenter returns when it is overloaded, not when the operation
+# itself is wrong
+THROTTLE_FAULTS = ['TooManyTickets', 'TooManyConcurrentNativeClones']
+
+
+def is_throttled(error):
+    return getattr(error, '_wsdlName', type(error).__name__) \
+        in THROTTLE_FAULTS
+
+
+class AdaptiveLimiter(object):
+
+    def __init__(self, initial, floor=1, ceiling=None, backoff=0.5,
+                 latency_factor=3.0, max_fault_rate=0.2, name='bulk'):
+        """
+        @param initial: limit to start with
+        @param floor: lowest limit, floor == ceiling keeps it fixed
+        @param ceiling: highest limit, initial by default
+        @param backoff: factor applied to the limit on a decrease
+        @param latency_factor: a window is slow when its mean latency
+        exceeds this many times the best window seen
+        @param max_fault_rate: highest healthy share of failed operations
+        @param name: name used in the log
+        """
+        self.ceiling = max(ceiling or initial, 1)
+        self.floor = min(max(floor, 1), self.ceiling)
+        self.limit = min(max(initial, self.floor), self.ceiling)
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.max_fault_rate = max_fault_rate
+        self.name = name
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        # Current window
+        self.window_count = 0
+        self.window_faults = 0
+        self.window_latency = 0.0
+        self.window_samples = 0
+        self.decreased = False
+        # Mean latency of the best window so far
+        self.best_latency = None
+        # Counters
+        self.completed = 0
+        self.faults = 0
+        self.throttled = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def adaptive(self):
+        return self.floor < self.ceiling
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, error=None, queued=False):
+        """Ends one operation and adapts the limit to its outcome.
+
+        @param latency: seconds the operation took
+        @param error: fault or exception it failed with, if any
+        @param queued: whether vCenter queued the task before running it
+        """
+        with self.cond:
+            self.in_flight -= 1
+            self.completed += 1
+            self.window_count += 1
+            if error is not None:
+                self.faults += 1
+                self.window_faults += 1
+            if latency is not None:
+                self.window_latency += latency
+                self.window_samples += 1
+            if self.adaptive():
+                if error is not None and is_throttled(error):
+                    self.throttled += 1
+                    self._decrease('throttled: {}'.format(
+                        getattr(error, 'msg', error)))
+                elif queued:
+                    self._decrease('task queued by vCenter')
+                if self.window_count >= self.limit:
+                    self._end_window()
+            self.cond.notify_all()
+
+    def _end_window(self):
+        mean_latency = None
+        if self.window_samples:
+            mean_latency = self.window_latency / self.window_samples
+        fault_rate = float(self.window_faults) / self.window_count
+        if fault_rate > self.max_fault_rate:
+            self._decrease('fault rate {:.0%}'.format(fault_rate))
+        elif self.best_latency and mean_latency and \
+                mean_latency > self.best_latency * self.latency_factor:
+            self._decrease('latency {:.1f}s, best {:.1f}s'.format(
+                mean_latency, self.best_latency))
+        elif not self.decreased:
+            self._set_limit(self.limit + 1, 'healthy window')
+        if mean_latency is not None and (self.best_latency is None or
+                                         mean_latency < self.best_latency):
+            self.best_latency = mean_latency
+        self.window_count = 0
+        self.window_faults = 0
+        self.window_latency = 0.0
+        self.window_samples = 0
+        self.decreased = False
+
+    def _decrease(self, reason):
+        if self.decreased:
+            return
+        self.decreased = True
+        self._set_limit(int(self.limit * self.backoff), reason)
+
+    def _set_limit(self, limit, reason):
+        limit = min(max(limit, self.floor), self.ceiling)
+        if limit == self.limit:
+            return
+        if limit > self.limit:
+            self.increases += 1
+        else:
+            self.decreases += 1
+        LOG.info('%s concurrency %d -> %d (%s)', self.name, self.limit,
+                 limit, reason)
+        self.limit = limit
+
+    def wrap(self, func, get_error=None):
+        """Returns func running under the limit, timed and with its
+        exceptions counted as faults.
+
+        @param get_error: optional callable(result) returning the fault a
+        call reported without raising it, None if it succeeded
+        """
+        def limited(*args, **kwargs):
+            self.acquire()
+            start = time.time()
+            error = None
+            try:
+                result = func(*args, **kwargs)
+                if get_error is not None:
+                    error = get_error(result)
+                return result
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self.release(time.time() - start, error)
+        return limited
+
+    def stats(self):
+        with self.cond:
+            return {'limit': self.limit, 'in_flight': self.in_flight,
+                    'completed': self.completed, 'faults': self.faults,
+                    'throttled': self.throttled,
+                    'increases': self.increases,
+                    'decreases': self.decreases}
+
+
+def get_limiter(concurrency, max_concurrency=None, name='bulk'):
+    """Returns a limiter starting at concurrency.
+
+    @param max_concurrency: ceiling of the adaptive limit, None keeps the
+    limit fixed at concurrency
+    """
+    if max_concurrency is None:
+        return AdaptiveLimiter(concurrency, concurrency, concurrency,
+                               name=name)
+    return AdaptiveLimiter(concurrency, 1, max_concurrency, name=name)
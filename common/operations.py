@@ -1,12 +1,57 @@
-import commands
 import re
+import bulk
+import limiter
+import stubs
+import thumbprint
 import vmwareapi
 from pyVmomi import vim
 import utils
 
 
-def get_vcenter(vc_ip, vc_user, vc_pwd):
-    return vmwareapi.VirtualCenter(vc_ip, vc_user, vc_pwd)
+# VirtualCenters whose sessions outlive the process
+_reused_vcs = []
+
+
+def get_vcenter(vc_ip, vc_user, vc_pwd, use_index=False,
+                reuse_session=False, pool_size=None, rate_limit=None):
+    vc = vmwareapi.VirtualCenter(vc_ip, vc_user, vc_pwd, use_index,
+                                 reuse_session, pool_size, rate_limit)
+    if reuse_session:
+        _reused_vcs.append(vc)
+    return vc
+
+
+def release_sessions():
+    """Destroys the views and collectors created in reused sessions.
+
+    The sessions stay logged in for the next process, but the server-side
+    objects of this one would otherwise pile up in them.
+    """
+    while _reused_vcs:
+        vc = _reused_vcs.pop()
+        try:
+            vc.release()
+        except Exception as e:
+            print 'Failed to release session objects on {}: {}'.format(
+                vc.host, e)
+
+
+def get_rate_limit(cf, section=utils.INFO_VC):
+    """Returns the stubs.RateLimit set by the optional call_rate, task_rate
+    and rate_shared options of a config section, None when no rate is set.
+    """
+    def get(option):
+        if cf.has_option(section, option):
+            return cf.get(section, option).strip()
+        return ''
+
+    calls = get('call_rate')
+    tasks = get('task_rate')
+    if not calls and not tasks:
+        return None
+    return stubs.RateLimit(float(calls) if calls else None,
+                           float(tasks) if tasks else None,
+                           get('rate_shared').lower() in ('yes', 'true', '1'))
 
 
 def get_datacenter(vc, dc_name):
@@ -19,53 +64,118 @@ def get_datacenter(vc, dc_name):
     return dc
 
 
+def get_cluster_spec(services_str=None):
+    """Builds the complete cluster config of the enabled services.
+
+    @param services_str: services separated by comma, e.g. drs,ha
+    @return vim.cluster.ConfigSpecEx
+    """
+    spec = vim.cluster.ConfigSpecEx()
+    for service in utils.get_items((services_str or '').lower()):
+        if service == 'drs':
+            spec.drsConfig = vim.cluster.DrsConfigInfo(enabled=True)
+            continue
+        if service == 'ha':
+            spec.dasConfig = vim.cluster.DasConfigInfo(enabled=True)
+            continue
+    return spec
+
+
+def get_cluster_spec_changes(spec, config):
+    """Returns the part of spec that differs from the cluster config.
+
+    @param spec: desired vim.cluster.ConfigSpecEx
+    @param config: current vim.cluster.ConfigInfoEx
+    @return vim.cluster.ConfigSpecEx, None when nothing differs
+    """
+    changes = vim.cluster.ConfigSpecEx()
+    changed = False
+    for name in ['drsConfig', 'dasConfig']:
+        desired = getattr(spec, name)
+        if desired is None:
+            continue
+        current = getattr(config, name)
+        if current is None or current.enabled != desired.enabled:
+            setattr(changes, name, desired)
+            changed = True
+    return changes if changed else None
+
+
 def create_cluster(dc, cluster_name, services_str=None):
+    spec = get_cluster_spec(services_str)
     cluster = dc.get_cluster_by_name(cluster_name)
     if cluster is None:
         print 'Create VC Cluster {}.'.format(cluster_name)
-        cluster = dc.create_cluster(cluster_name)
-    if services_str:
-        services = services_str.strip().lower().split(',')
-        for service in services:
-            service = service.strip()
-            if service == 'drs':
-                cluster.enable_drs()
-                continue
-            if service == 'ha':
-                cluster.enable_ha()
-                continue
+        return dc.create_cluster(cluster_name, spec)
+    changes = get_cluster_spec_changes(spec, cluster.config())
+    if changes is not None:
+        print 'Reconfigure VC Cluster {}.'.format(cluster_name)
+        cluster.reconfigure(changes)
     return cluster
 
 
-def add_hosts_to_cluster(vc, cluster, host_user, host_pwd, host_names_str):
-    # Get host accout info
+def get_host_connect_spec(host_name, host_user, host_pwd, fingerprint):
     host_connect_spec = vim.host.ConnectSpec()
+    host_connect_spec.hostName = host_name
     host_connect_spec.userName = host_user
     host_connect_spec.password = host_pwd
+    host_connect_spec.sslThumbprint = fingerprint
     host_connect_spec.force = True
-    all_hosts = vc.get_hosts()
-    exist_hosts = []
-    for host in all_hosts:
-        exist_hosts.append(host.host_system.name)
-    host_names = get_host_list(host_names_str)
+    return host_connect_spec
+
+
+def add_hosts_to_cluster(vc, cluster, host_user, host_pwd, host_names_str,
+                         concurrency=8):
+    """Adds the missing hosts to the cluster, concurrency hosts at a time.
+
+    @return dict host name -> None when added or already in VC, else the
+    fault that prevented adding it
+    """
+    exist_hosts = [name for host, name in vc.get_host_names()]
+    host_names = [host_name.strip()
+                  for host_name in get_host_list(host_names_str)]
+    report = {}
+    new_hosts = []
     for host_name in host_names:
-        host_name = host_name.strip()
-        host_connect_spec.sslThumbprint = get_fingerprint(host_name)
-        host_connect_spec.hostName = host_name
         # Only add non-exist hosts
-        if host_name not in exist_hosts:
-            print 'Add host {} to VC cluster {}.'.format(host_name,
-                                                         cluster.name)
-            cluster.add_host(host_connect_spec)
-        else:
+        if host_name in exist_hosts:
             print 'Host {} already exist in current VC'.format(host_name)
+            report[host_name] = None
+        elif host_name not in new_hosts:
+            new_hosts.append(host_name)
+
+    def add_host(host_name):
+        print 'Add host {} to VC cluster {}.'.format(host_name,
+                                                     cluster.name())
+        return cluster.add_host_task(get_host_connect_spec(
+            host_name, host_user, host_pwd, fingerprints.get(host_name)))
+
+    fingerprints = thumbprint.get_thumbprints(new_hosts)
+    results = bulk.run_tasks(cluster.si, new_hosts, add_host, concurrency)
+    # Hosts whose certificate changed since it was cached
+    mismatch = [result.item for result in results
+                if isinstance(result.error, vim.fault.SSLVerifyFault)]
+    if mismatch:
+        fingerprints.update(thumbprint.get_thumbprints(mismatch,
+                                                       refresh=True))
+        results = [result for result in results
+                   if result.item not in mismatch]
+        results.extend(bulk.run_tasks(cluster.si, mismatch, add_host,
+                                      concurrency))
+
+    for result in results:
+        report[result.item] = None if result.ok() else result.error
+    failed = [host_name for host_name in new_hosts if report[host_name]]
+    for host_name in failed:
+        print 'Failed to add host {}: {}'.format(
+            host_name, getattr(report[host_name], 'msg', report[host_name]))
+    print 'Cluster {}: {} hosts added, {} failed.'.format(
+        cluster.name(), len(new_hosts) - len(failed), len(failed))
+    return report
 
 
 def get_fingerprint(host_name):
-    cmd = "echo -n | openssl s_client -connect {}:443 2>/dev/null " \
-          "| openssl x509 -noout -fingerprint -sha1"
-    result = commands.getoutput(cmd.format(host_name)).split('=')
-    return result[1] if result else None
+    return thumbprint.get_thumbprint(host_name)
 
 
 def is_ip_range(range_str):
@@ -105,17 +215,94 @@ def get_host_list(host_names):
     return host_names
 
 
-def config_hosts(vc, services_str, ntp=None, licensekey=None, fw_rule=None):
+def run_on_hosts(hosts, action, func, concurrency=16):
+    """Runs func(host) on every host, concurrency hosts at a time.
+
+    Progress and the time spent on each host are printed as hosts finish.
+    @param hosts: list of vmwareapi.Host
+    @param action: description of func used in the progress lines
+    @return list of names of the hosts func failed on
+    """
+    total = len(hosts)
+    finished = []
+    failed = []
+
+    def report(result):
+        finished.append(result)
+        host_name = result.item.name()
+        if result.ok():
+            print '[{}/{}] {} on host {} done in {:.1f}s.'.format(
+                len(finished), total, action, host_name, result.elapsed)
+        else:
+            failed.append(host_name)
+            print '[{}/{}] {} on host {} failed after {:.1f}s: {}'.format(
+                len(finished), total, action, host_name, result.elapsed,
+                getattr(result.error, 'msg', result.error))
+
+    bulk.run_calls(hosts, func, concurrency, on_done=report)
+    if failed:
+        print '{} failed on {} of {} hosts.'.format(action, len(failed), total)
+    return failed
+
+
+def get_all_hosts(vc):
+    """Returns a vmwareapi.Host for every host of the VC."""
+    return [vmwareapi.Host(vc.si, host, {'name': name})
+            for host, name in vc.get_host_names()]
+
+
+def get_hosts_by_names(vc, hosts_str):
+    """Resolves a host list string, printing the hosts not in the VC."""
+    return resolve_hosts(vc, get_host_list(hosts_str))
+
+
+def resolve_hosts(vc, host_names):
+    """Resolves host names, printing the hosts not in the VC."""
+    found = vc.get_hosts_by_names(host_names)
+    hosts = []
+    for host_name in host_names:
+        if host_name in found:
+            hosts.append(found.pop(host_name))
+        elif not any(host.name() == host_name for host in hosts):
+            print 'Host {} not exist in VC'.format(host_name)
+    return hosts
+
+
+def get_host_settings(ntp=None, licensekey=None, services=None, rules=None):
+    """Returns the settings config_host_settings applies to one host."""
+    return {'ntp': ntp, 'license': licensekey,
+            'services': list(services or []), 'rules': list(rules or [])}
+
+
+def config_hosts(vc, services_str, ntp=None, licensekey=None, fw_rule=None,
+                 concurrency=16):
     # Config All Hosts
     services = utils.get_items(services_str)
     rules = utils.get_items(fw_rule)
-    all_hosts = vc.get_hosts()
-    for host in all_hosts:
-        if ntp:
-            host.enable_ntp(ntp=ntp)
-        if licensekey:
-            host.add_license(license_key=licensekey)
-        for service in services:
+    hosts = get_all_hosts(vc)
+    settings = dict((host.name(),
+                     get_host_settings(ntp, licensekey, services, rules))
+                    for host in hosts)
+    return config_host_settings(hosts, settings, concurrency)
+
+
+def config_host_settings(hosts, settings, concurrency=16):
+    """Applies per host settings, concurrency hosts at a time.
+
+    @param hosts: list of vmwareapi.Host, the hosts without settings are
+    left alone
+    @param settings: dict host name -> dict from get_host_settings
+    @return list of names of the hosts that failed
+    """
+    hosts = [host for host in hosts if host.name() in settings]
+
+    def config_host(host):
+        host_settings = settings[host.name()]
+        if host_settings['ntp']:
+            host.enable_ntp(ntp=host_settings['ntp'])
+        if host_settings['license']:
+            host.add_license(license_key=host_settings['license'])
+        for service in host_settings['services']:
             if service == 'ssh':
                 host.enable_ssh()
                 continue
@@ -123,65 +310,87 @@ def config_hosts(vc, services_str, ntp=None, licensekey=None, fw_rule=None):
                 # Config default vMotion network
                 host.config_vmotion()
                 continue
-        for rule in rules:
+        for rule in host_settings['rules']:
             host.config_firewall(rule)
 
+    return run_on_hosts(hosts, 'Host config', config_host, concurrency)
+
 
 def create_dvs(vc, dc, dvs_name, nic_index=1, target_hosts_str=None,
                pgs_pair=None):
-    hosts = vc.get_hosts()
+    # Names and pnics of all hosts in one round trip
+    hosts = dict((props.get('name'), (host, props))
+                 for host, props in vc.get_inventory(
+                     vim.HostSystem, ['name', 'config.network.pnic']))
     if target_hosts_str and '' != target_hosts_str:
-        host_names = get_host_list(target_hosts_str)
-        hosts = [vc.get_host_by_name(host_name.strip())
-                 for host_name in host_names]
+        host_names = [host_name.strip()
+                      for host_name in get_host_list(target_hosts_str)]
+        for host_name in set(host_names) - set(hosts):
+            print 'Host {} not exist in VC'.format(host_name)
+        hosts = dict((host_name, hosts[host_name])
+                     for host_name in host_names if host_name in hosts)
 
     dvs = dc.get_dvs_by_name(dvs_name)
     if dvs is None:
         dvs_spec = vim.DistributedVirtualSwitch.CreateSpec()
         dvs_config = vim.dvs.VmwareDistributedVirtualSwitch.ConfigSpec()
         dvs_config.name = dvs_name
-        dvs_config.host =\
-            [get_host_member_spec(host, nic_index) for host in hosts]
+        dvs_config.host = get_host_member_specs(hosts.values(), nic_index)
         dvs_spec.configSpec = dvs_config
         print 'Create DVS {}.'.format(dvs_name)
         dvs = dc.create_dvs(dvs_spec)
     else:
-        dvs_config_spec = vim.DistributedVirtualSwitch.ConfigSpec()
-        dvs_config = dvs.config()
-        for host_mem in dvs_config.host:
-            host_name = host_mem.config.host.name
-            for host in hosts:
-                if host_name == host.host_system.name:
-                    hosts.remove(host)
-        if hosts:
-            dvs_config_spec.configVersion = dvs_config.configVersion
-            dvs_config_spec.host = [get_host_member_spec(
-                host, nic_index) for host in hosts]
+        members, config_version = dvs.get_host_members()
+        new_hosts = [hosts[host_name] for host_name in sorted(hosts)
+                     if hosts[host_name][0] not in members]
+        if new_hosts:
+            dvs_config_spec = vim.DistributedVirtualSwitch.ConfigSpec()
+            dvs_config_spec.configVersion = config_version
+            dvs_config_spec.host = get_host_member_specs(new_hosts, nic_index)
+            print 'Add {} hosts to DVS {}.'.format(len(new_hosts), dvs_name)
             dvs.reconfig_dvs(dvs_config_spec)
         else:
             print 'All target hosts already in dvs {}'.format(dvs_name)
 
+    # Create the non-existing portgroups in one task
+    pgs = dvs.get_portgroups()
+    specs = []
     for pg_pair in pgs_pair:
         pg_pair_list = pg_pair.split(':')
         pg_name = pg_pair_list[0].strip()
         vlan_id = pg_pair_list[1].strip()
-        # create non-existing portgroup
-        if dvs.get_portgroup(pg_name):
+        if pg_name in pgs:
             print 'PortGroup {} already exist in DVS {}'\
                 .format(pg_name, dvs_name)
-        else:
+        elif pg_name not in [spec.name for spec in specs]:
             print 'Add portgroup {} to DVS {}.'.format(pg_name, dvs_name)
-            dvs.add_portgroup(get_port_group_spec(pg_name, vlan_id))
-
-
-def get_host_member_spec(host, nic_index):
+            specs.append(get_port_group_spec(pg_name, vlan_id))
+    if specs:
+        dvs.add_portgroups(specs)
+
+
+def get_host_member_specs(hosts, nic_index):
+    """Builds member specs of (vim.HostSystem, props) tuples whose props
+    hold 'config.network.pnic'; hosts without the pnic are left out.
+    """
+    specs = []
+    for host, props in hosts:
+        pnics = props.get('config.network.pnic') or []
+        if nic_index >= len(pnics):
+            print 'Host {} has no pnic {}, not added to DVS.'.format(
+                props.get('name'), nic_index)
+            continue
+        specs.append(get_host_member_spec(host, pnics[nic_index].device))
+    return specs
+
+
+def get_host_member_spec(host_system, pnic_device):
     host_member_spec = vim.dvs.HostMember.ConfigSpec()
-    host_member_spec.host = host.host_system
+    host_member_spec.host = host_system
     host_member_spec.operation = vim.ConfigSpecOperation.add
 
     backing = vim.dvs.HostMember.PnicBacking()
-    backing.pnicSpec = [vim.dvs.HostMember.PnicSpec(
-        pnicDevice=host.host_system.config.network.pnic[nic_index].device)]
+    backing.pnicSpec = [vim.dvs.HostMember.PnicSpec(pnicDevice=pnic_device)]
     host_member_spec.backing = backing
 
     return host_member_spec
@@ -206,24 +415,38 @@ def get_port_group_spec(pg_name, vlan_id):
     return spec
 
 
-def add_nfs_to_host(vc, remote_host, remote_path, ds_name, target_hosts):
+def add_nfs_to_host(vc, remote_host, remote_path, ds_name, target_hosts,
+                    concurrency=16):
+    """Mounts the NFS export on the target hosts, concurrency at a time.
+
+    @return list of names of the hosts the mount failed on
+    """
     ds_spec = vim.host.NasVolume.Specification()
     ds_spec.localPath = ds_name
     ds_spec.remoteHost = remote_host
     ds_spec.remotePath = remote_path
     ds_spec.accessMode = "readWrite"
-    hosts = get_host_list(target_hosts)
-    for host_name in hosts:
-        target_host = vc.get_host_by_name(host_name)
-        if target_host:
-            ds = target_host.get_datastore_by_name(ds_name)
-            if ds is None:
-                target_host.add_nfs_datastore(ds_spec)
-            else:
-                print 'Datastore {} already in host {}'.format(ds_name, host_name)
-        else:
+    # Hosts with their datastores and the datastore names in one round trip
+    snapshot = dict(vc.get_inventory_snapshot(
+        [(vim.HostSystem, ['name', 'datastore']), (vim.Datastore, ['name'])]))
+    hosts = dict((props.get('name'), (host, props))
+                 for host, props in snapshot.items()
+                 if isinstance(host, vim.HostSystem))
+    targets = []
+    for host_name in get_host_list(target_hosts):
+        if host_name not in hosts:
             print 'Target host {} not exist in the current VC.'\
                 .format(host_name)
+            continue
+        host, props = hosts.pop(host_name)
+        if ds_name in [snapshot.get(ds, {}).get('name')
+                       for ds in props.get('datastore', [])]:
+            print 'Datastore {} already in host {}'.format(ds_name, host_name)
+        else:
+            targets.append(vmwareapi.Host(vc.si, host, {'name': host_name}))
+    return run_on_hosts(targets, 'Mount NFS {}'.format(ds_name),
+                        lambda host: host.add_nfs_datastore(ds_spec),
+                        concurrency)
 
 
 def call_func(instance, name, args=(), kwargs=None):
@@ -232,7 +455,8 @@ def call_func(instance, name, args=(), kwargs=None):
     return getattr(instance, name)(*args, **kwargs)
 
 
-def vmotion(dc, vm_reg, host_name, ds_name, concurrency=10):
+def vmotion(dc, vm_reg, host_name, ds_name, concurrency=10,
+            max_concurrency=None):
     host = dc.get_host_by_name(host_name)
     ds = dc.get_datastore_by_name(ds_name)
     if host is None:
@@ -242,46 +466,34 @@ def vmotion(dc, vm_reg, host_name, ds_name, concurrency=10):
         print 'Datastore {} not exist on DC.'.format(ds_name)
         exit(1)
     vms = dc.get_vms_by_regex(utils.get_items(vm_reg))
-    vm_num = len(vms)
-    import threadpool
-    size = concurrency if concurrency < vm_num else vm_num
-    pool = threadpool.ThreadPool(size)
-    reqs = [threadpool.WorkRequest(call_func, args=(vm, 'migrate', (host, ds)))
-            for vm in vms]
-    for req in reqs:
-        pool.putRequest(req)
-    pool.wait()
+    slots = limiter.get_limiter(concurrency, max_concurrency, 'migrate')
+    results = bulk.run_tasks(dc.si, vms,
+                             lambda vm: vm.migrate_task(host, ds), slots)
+    for result in results:
+        if not result.ok():
+            print 'Failed to migrate {}: {}'.format(
+                result.item.name(), getattr(result.error, 'msg', result.error))
     exit(0)
 
 
-def cfg_esxi_service(vc, hosts, service, action):
-    host_list = get_host_list(hosts)
-    for host_name in host_list:
-        host = vc.get_host_by_name(host_name)
-        if host:
-            host.config_services(service, action)
-        else:
-            print 'Host {} not exist in VC'.format(host_name)
+def cfg_esxi_service(vc, hosts, service, action, concurrency=16):
+    return run_on_hosts(get_hosts_by_names(vc, hosts),
+                        'Service {} {}'.format(service, action),
+                        lambda host: host.config_services(service, action),
+                        concurrency)
 
 
-def cfg_esxi_fw_rule(vc, hosts, rule, action):
-    host_list = get_host_list(hosts)
-    for host_name in host_list:
-        host = vc.get_host_by_name(host_name)
-        if host:
-            host.config_firewall(rule, action)
-        else:
-            print 'Host {} not exist in VC'.format(host_name)
+def cfg_esxi_fw_rule(vc, hosts, rule, action, concurrency=16):
+    return run_on_hosts(get_hosts_by_names(vc, hosts),
+                        'Firewall rule {} {}'.format(rule, action),
+                        lambda host: host.config_firewall(rule, action),
+                        concurrency)
 
 
-def cfg_esxi_vmotion(vc, hosts, nic_num=0):
-    host_list = get_host_list(hosts)
-    for host_name in host_list:
-        host = vc.get_host_by_name(host_name)
-        if host:
-            host.config_vmotion(nic_num)
-        else:
-            print 'Host {} not exist in VC'.format(host_name)
+def cfg_esxi_vmotion(vc, hosts, nic_num=0, concurrency=16):
+    return run_on_hosts(get_hosts_by_names(vc, hosts), 'vMotion config',
+                        lambda host: host.config_vmotion(nic_num),
+                        concurrency)
 
 
 def cfg_autostart(vc, host_name, vms):
@@ -328,9 +540,9 @@ def get_pg_id(vc, dc_name, vds_name, pg_name):
     if vds is None:
         print 'vDS {} not exist on data center {}'.format(vds_name, dc_name)
         return None
-    pg = vds.get_portgroup(pg_name)
+    pg = vds.get_portgroups().get(pg_name)
     if pg:
-        return pg.key
+        return pg[1].get('key')
     else:
         print 'Portgroup {} not exist on vds {}'.format(pg_name, vds_name)
         return None
\ No newline at end of file
@@ -9,7 +9,9 @@ def _get_vc():
     vc_ip = cf.get(utils.INFO_VC, 'opt_vc')
     vc_user = cf.get(utils.INFO_VC, 'vc_user')
     vc_pwd = cf.get(utils.INFO_VC, 'vc_pwd')
-    return operations.get_vcenter(vc_ip, vc_user, vc_pwd)
+    return operations.get_vcenter(vc_ip, vc_user, vc_pwd,
+                                  reuse_session=True,
+                                  rate_limit=operations.get_rate_limit(cf))
 
 
 # VC site operations
@@ -237,8 +239,11 @@ def add_host(args):
     vc = _get_vc()
     dc = operations.get_datacenter(vc, args.dc_name)
     cluster = operations.create_cluster(dc, args.cluster_name)
-    operations.add_hosts_to_cluster(vc, cluster, args.host_user, args.host_pwd,
-                                    args.host_names)
+    report = operations.add_hosts_to_cluster(vc, cluster, args.host_user,
+                                             args.host_pwd, args.host_names,
+                                             args.concurrency)
+    if any(report.values()):
+        exit(1)
 
 
 def add_host_parser(subparsers):
@@ -282,6 +287,15 @@ def add_host_parser(subparsers):
         help='Host password',
         dest='host_pwd'
     )
+    parser.add_argument(
+        '--concurrency',
+        action='store',
+        type=int,
+        help='[Optional] Number of hosts added at the same time. '
+             '8 by default.',
+        default=8,
+        dest='concurrency'
+    )
     parser.set_defaults(func=add_host)
 
 
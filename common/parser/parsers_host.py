@@ -3,18 +3,22 @@ from common import operations
 from common import utils
 
 
-def _get_vc():
+def _get_vc(pool_size=None):
     cf = ConfigParser.ConfigParser()
     cf.read(utils.CONFIG_FILE_PATH)
     vc_ip = cf.get(utils.INFO_VC, 'opt_vc')
     vc_user = cf.get(utils.INFO_VC, 'vc_user')
     vc_pwd = cf.get(utils.INFO_VC, 'vc_pwd')
-    return operations.get_vcenter(vc_ip, vc_user, vc_pwd)
+    return operations.get_vcenter(vc_ip, vc_user, vc_pwd,
+                                  reuse_session=True, pool_size=pool_size,
+                                  rate_limit=operations.get_rate_limit(cf))
 
 
 def config_host(args):
-    vc = _get_vc()
-    operations.config_hosts(vc, args.services, args.ntp, args.license)
+    vc = _get_vc(args.concurrency)
+    if operations.config_hosts(vc, args.services, args.ntp, args.license,
+                               concurrency=args.concurrency):
+        exit(1)
 
 
 def config_host_parser(subparsers):
@@ -43,17 +47,27 @@ def config_host_parser(subparsers):
         default=None,
         dest='license'
     )
+    parser.add_argument(
+        '--concurrency',
+        action='store',
+        type=int,
+        help='[Optional] Number of hosts configured at the same time. '
+             '16 by default.',
+        default=16,
+        dest='concurrency'
+    )
     parser.set_defaults(func=config_host)
 
 
 def add_nfs(args):
-    vc = _get_vc()
+    vc = _get_vc(args.concurrency)
     ds_name = args.ds_name
     remote_host = args.remote_host
     remote_path = args.remote_path
     target_hosts = args.target_hosts
-    operations.add_nfs_to_host(vc, remote_host, remote_path, ds_name,
-                               target_hosts)
+    if operations.add_nfs_to_host(vc, remote_host, remote_path, ds_name,
+                                  target_hosts, args.concurrency):
+        exit(1)
 
 
 def add_nfs_parser(subparsers):
@@ -89,12 +103,23 @@ def add_nfs_parser(subparsers):
         help='Target hosts the nfs mounted. Separated by comma.',
         dest='target_hosts'
     )
+    parser.add_argument(
+        '--concurrency',
+        action='store',
+        type=int,
+        help='[Optional] Number of hosts mounted at the same time. '
+             '16 by default.',
+        default=16,
+        dest='concurrency'
+    )
     parser.set_defaults(func=add_nfs)
 
 
 def config_service(args):
-    vc = _get_vc()
-    operations.cfg_esxi_service(vc, args.hosts, args.service, args.action)
+    vc = _get_vc(args.concurrency)
+    if operations.cfg_esxi_service(vc, args.hosts, args.service, args.action,
+                                   args.concurrency):
+        exit(1)
 
 
 def config_service_parser(subparsers):
@@ -126,12 +151,23 @@ def config_service_parser(subparsers):
         choices=utils.SERVICES,
         dest='service'
     )
+    parser.add_argument(
+        '--concurrency',
+        action='store',
+        type=int,
+        help='[Optional] Number of hosts configured at the same time. '
+             '16 by default.',
+        default=16,
+        dest='concurrency'
+    )
     parser.set_defaults(func=config_service)
 
 
 def config_rule(args):
-    vc = _get_vc()
-    operations.cfg_esxi_fw_rule(vc, args.hosts, args.rule, args.action)
+    vc = _get_vc(args.concurrency)
+    if operations.cfg_esxi_fw_rule(vc, args.hosts, args.rule, args.action,
+                                   args.concurrency):
+        exit(1)
 
 
 def config_rule_parser(subparsers):
@@ -163,6 +199,15 @@ def config_rule_parser(subparsers):
         choices=utils.RULES,
         dest='rule'
     )
+    parser.add_argument(
+        '--concurrency',
+        action='store',
+        type=int,
+        help='[Optional] Number of hosts configured at the same time. '
+             '16 by default.',
+        default=16,
+        dest='concurrency'
+    )
     parser.set_defaults(func=config_rule)
 
 
@@ -199,8 +244,10 @@ def maintenance_parser(subparsers):
 
 
 def config_vmotion(args):
-    vc = _get_vc()
-    operations.cfg_esxi_vmotion(vc, args.hosts, args.nic)
+    vc = _get_vc(args.concurrency)
+    if operations.cfg_esxi_vmotion(vc, args.hosts, args.nic,
+                                   args.concurrency):
+        exit(1)
 
 
 def config_vmotion_parser(subparsers):
@@ -224,6 +271,15 @@ def config_vmotion_parser(subparsers):
         default=0,
         dest='nic'
     )
+    parser.add_argument(
+        '--concurrency',
+        action='store',
+        type=int,
+        help='[Optional] Number of hosts configured at the same time. '
+             '16 by default.',
+        default=16,
+        dest='concurrency'
+    )
     parser.set_defaults(func=config_vmotion)
 
 
@@ -9,7 +9,9 @@ def _get_vc():
     vc_ip = cf.get(utils.INFO_VC, 'opt_vc')
     vc_user = cf.get(utils.INFO_VC, 'vc_user')
     vc_pwd = cf.get(utils.INFO_VC, 'vc_pwd')
-    return operations.get_vcenter(vc_ip, vc_user, vc_pwd)
+    return operations.get_vcenter(vc_ip, vc_user, vc_pwd,
+                                  reuse_session=True,
+                                  rate_limit=operations.get_rate_limit(cf))
 
 
 # Net site operations
@@ -3,23 +3,26 @@ from common import operations
 from common import utils
 
 
-def _get_vc():
+def _get_vc(pool_size=None):
     cf = ConfigParser.ConfigParser()
     cf.read(utils.CONFIG_FILE_PATH)
     vc_ip = cf.get(utils.INFO_VC, 'opt_vc')
     vc_user = cf.get(utils.INFO_VC, 'vc_user')
     vc_pwd = cf.get(utils.INFO_VC, 'vc_pwd')
-    return operations.get_vcenter(vc_ip, vc_user, vc_pwd)
+    return operations.get_vcenter(vc_ip, vc_user, vc_pwd,
+                                  reuse_session=True, pool_size=pool_size,
+                                  rate_limit=operations.get_rate_limit(cf))
 
 
 # VM site operations
 def migrate(args):
-    vc = _get_vc()
+    vc = _get_vc(max(args.concurrency, args.max_concurrency))
     dc = vc.get_datacenter_by_name(args.dc)
     if dc is None:
         print 'Data center {} not exist on VC'.format(args.dc)
         exit(1)
-    operations.vmotion(dc, args.vm_reg, args.host, args.ds, args.concurrency)
+    operations.vmotion(dc, args.vm_reg, args.host, args.ds, args.concurrency,
+                       args.max_concurrency)
 
 
 def migrate_parser(subparsers):
@@ -64,6 +67,14 @@ def migrate_parser(subparsers):
         default=10,
         dest='concurrency'
     )
+    parser.add_argument(
+        '--max-concurrency',
+        action='store',
+        type=int,
+        help='[Optional] Let the number of migrate tasks in flight adapt '
+             'between 1 and this, starting at --concurrency.',
+        dest='max_concurrency'
+    )
     parser.set_defaults(func=migrate)
 
 
@@ -0,0 +1,323 @@
+"""Change plan of vc-cfg
+
+A plan compares config.ini with one inventory snapshot of a vCenter and
+lists only the changes still required: missing datacenters, clusters,
+hosts, portgroups and NFS mounts, and host settings that differ. The
+snapshot is a single RetrievePropertiesEx plus one license query, so
+planning an already configured site costs a few round trips.
+"""
+
+from pyVmomi import vim
+import operations
+import utils
+
+# Change kinds
+LICENSE = 'license'
+DATACENTER = 'datacenter'
+CLUSTER = 'cluster'
+CLUSTER_SERVICE = 'cluster service'
+HOST = 'host'
+HOST_NTP = 'host ntp'
+HOST_LICENSE = 'host license'
+HOST_SERVICE = 'host service'
+HOST_RULE = 'host rule'
+DVS = 'dvs'
+DVS_HOST = 'dvs host'
+PORTGROUP = 'portgroup'
+NFS = 'nfs'
+
+SNAPSHOT_PATHS = [
+    (vim.Datacenter, ['name', 'parent']),
+    (vim.Folder, ['name', 'parent']),
+    (vim.ComputeResource, ['name', 'parent']),
+    (vim.ClusterComputeResource, ['configurationEx']),
+    (vim.HostSystem, ['name', 'parent', 'datastore', 'config.dateTimeInfo',
+                      'config.service', 'config.firewall', 'config.vmotion']),
+    (vim.Datastore, ['name']),
+    (vim.DistributedVirtualSwitch, ['name', 'parent', 'config.host',
+                                    'portgroup']),
+    (vim.dvs.DistributedVirtualPortgroup, ['name']),
+]
+
+
+class Change(object):
+    """One change of a config section"""
+
+    def __init__(self, section, kind, target, value=None):
+        self.section = section
+        self.kind = kind
+        self.target = target
+        self.value = value
+
+    def __str__(self):
+        if self.value is None:
+            return '{}: {} {}'.format(self.section, self.kind, self.target)
+        return '{}: {} {} -> {}'.format(self.section, self.kind, self.target,
+                                        self.value)
+
+
+class Snapshot(object):
+    """Current state of one vCenter taken in one round trip"""
+
+    def __init__(self, vc):
+        self.props = dict(vc.get_inventory_snapshot(SNAPSHOT_PATHS))
+        rc = vc.si.RetrieveContent()
+        self.vc_uuid = rc.about.instanceUuid
+        assignments = rc.licenseManager.licenseAssignmentManager\
+            .QueryAssignedLicenses()
+        self.licenses = dict((assignment.entityId,
+                              assignment.assignedLicense.licenseKey)
+                             for assignment in assignments or [])
+
+    def name(self, obj):
+        return self.props.get(obj, {}).get('name')
+
+    def objects(self, vimtype):
+        return [obj for obj in self.props if isinstance(obj, vimtype)]
+
+    def datacenter_of(self, obj):
+        parent = self.props.get(obj, {}).get('parent')
+        while parent is not None and not isinstance(parent, vim.Datacenter):
+            parent = self.props.get(parent, {}).get('parent')
+        return parent
+
+    def find(self, vimtype, name, dc=None):
+        for obj in self.objects(vimtype):
+            if self.name(obj) == name and \
+                    (dc is None or self.datacenter_of(obj) == dc):
+                return obj
+        return None
+
+    def hosts(self):
+        """Returns dict host name -> vim.HostSystem"""
+        return dict((self.name(host), host)
+                    for host in self.objects(vim.HostSystem))
+
+    def host_datastores(self, host):
+        return [self.name(ds) for ds in self.props[host].get('datastore', [])]
+
+    def host_license(self, host):
+        return self.licenses.get(host._moId)
+
+    def host_ntp(self, host):
+        date_time = self.props[host].get('config.dateTimeInfo')
+        if date_time is None or date_time.ntpConfig is None:
+            return []
+        return list(date_time.ntpConfig.server or [])
+
+    def host_running_services(self, host):
+        service_info = self.props[host].get('config.service')
+        if service_info is None:
+            return []
+        return [service.key for service in service_info.service or []
+                if service.running]
+
+    def host_enabled_rules(self, host):
+        firewall = self.props[host].get('config.firewall')
+        if firewall is None:
+            return []
+        return [rule.key for rule in firewall.ruleset or [] if rule.enabled]
+
+    def host_vmotion_enabled(self, host):
+        vmotion = self.props[host].get('config.vmotion')
+        return bool(vmotion and vmotion.netConfig and
+                    vmotion.netConfig.selectedVnic)
+
+    def cluster_services(self, cluster):
+        config = self.props[cluster].get('configurationEx')
+        services = []
+        if config is None:
+            return services
+        if config.drsConfig and config.drsConfig.enabled:
+            services.append('drs')
+        if config.dasConfig and config.dasConfig.enabled:
+            services.append('ha')
+        return services
+
+    def dvs_hosts(self, dvs):
+        return [self.name(member.config.host)
+                for member in self.props[dvs].get('config.host') or []]
+
+    def dvs_portgroups(self, dvs):
+        return [self.name(pg) for pg in self.props[dvs].get('portgroup', [])]
+
+
+class Plan(object):
+    """Changes config.ini requires on one vCenter"""
+
+    def __init__(self, vc_item, vc):
+        self.vc_item = vc_item
+        # VirtualCenter the plan was computed on, reused to apply it
+        self.vc = vc
+        self.changes = []
+
+    def add(self, section, kind, target, value=None):
+        self.changes.append(Change(section, kind, target, value))
+
+    def changed(self, section):
+        return any(change.section == section for change in self.changes)
+
+    def get(self, section, kind):
+        return [change for change in self.changes
+                if change.section == section and change.kind == kind]
+
+    def targets(self, section, kind):
+        return [change.target for change in self.get(section, kind)]
+
+    def host_settings(self, section):
+        """Returns the host settings to change as expected by
+        operations.config_host_settings
+        """
+        settings = {}
+        for change in self.changes:
+            if change.section != section:
+                continue
+            host_settings = settings.setdefault(
+                change.target, operations.get_host_settings())
+            if change.kind == HOST_NTP:
+                host_settings['ntp'] = change.value
+            elif change.kind == HOST_LICENSE:
+                host_settings['license'] = change.value
+            elif change.kind == HOST_SERVICE:
+                host_settings['services'].append(change.value)
+            elif change.kind == HOST_RULE:
+                host_settings['rules'].append(change.value)
+        return settings
+
+    def show(self):
+        if not self.changes:
+            print '{}: no changes.'.format(self.vc_item)
+            return
+        print '{}: {} changes.'.format(self.vc_item, len(self.changes))
+        for change in self.changes:
+            print '  {}'.format(change)
+        if self.changed('hosts_' + self.vc_item):
+            print '  (info_host settings apply to every host of the vCenter)'
+
+
+def get_host_names(hosts_str):
+    """Returns the host names of a host list option, an empty option or
+    entry names no host.
+    """
+    return [host_name for host_name in operations.get_host_list(hosts_str)
+            if host_name]
+
+
+def plan_vc(cf, vc_item, vc):
+    """Computes the changes config.ini requires on the vCenter of vc_item.
+
+    @param cf: ConfigParser of config.ini
+    @param vc_item: vc_N section name
+    @param vc: connected VirtualCenter instance of the section
+    @return Plan instance
+    """
+    plan = Plan(vc_item, vc)
+    snapshot = Snapshot(vc)
+    sections = cf.sections()
+    hosts = snapshot.hosts()
+
+    license_key = cf.get(utils.INFO_VC, 'license')
+    if license_key and snapshot.licenses.get(snapshot.vc_uuid) != license_key:
+        plan.add(vc_item, LICENSE, vc.host, license_key)
+
+    dc_items = utils.get_children(cf, sections, utils.DC_INS_PREFIX,
+                                  [vc_item])
+    dcs = {}
+    for dc_item in dc_items:
+        dc_name = cf.get(dc_item, 'name')
+        dcs[dc_item] = snapshot.find(vim.Datacenter, dc_name)
+        if dcs[dc_item] is None:
+            plan.add(dc_item, DATACENTER, dc_name)
+
+    # Hosts added by the clusters of this vCenter
+    added_hosts = []
+    for section in utils.get_children(cf, sections, utils.CLUSTER_INS_PREFIX,
+                                      dc_items):
+        dc = dcs[cf.get(section, 'parent')]
+        cluster_name = cf.get(section, 'name')
+        cluster = None if dc is None else snapshot.find(
+            vim.ClusterComputeResource, cluster_name, dc)
+        if cluster is None:
+            plan.add(section, CLUSTER, cluster_name)
+        current = [] if cluster is None else snapshot.cluster_services(cluster)
+        for service in utils.get_items(cf.get(section, 'services').lower()):
+            if service in ('drs', 'ha') and service not in current:
+                plan.add(section, CLUSTER_SERVICE, cluster_name, service)
+        for host_name in get_host_names(cf.get(section, 'host_add_list')):
+            if host_name not in hosts and host_name not in added_hosts:
+                plan.add(section, HOST, host_name)
+                added_hosts.append(host_name)
+    all_hosts = sorted(hosts.keys() + added_hosts)
+
+    plan_hosts(cf, 'hosts_' + vc_item, plan, snapshot, hosts, added_hosts)
+
+    for section in utils.get_children(cf, sections, utils.DVS_INS_PREFIX,
+                                      dc_items):
+        dc = dcs[cf.get(section, 'parent')]
+        dvs_name = cf.get(section, 'name')
+        dvs = None if dc is None else snapshot.find(
+            vim.DistributedVirtualSwitch, dvs_name, dc)
+        if dvs is None:
+            plan.add(section, DVS, dvs_name)
+        target_hosts = cf.get(section, 'host_list')
+        target_hosts = operations.get_host_list(target_hosts) \
+            if target_hosts else all_hosts
+        members = [] if dvs is None else snapshot.dvs_hosts(dvs)
+        for host_name in target_hosts:
+            if host_name not in members:
+                plan.add(section, DVS_HOST, host_name)
+        pgs = [] if dvs is None else snapshot.dvs_portgroups(dvs)
+        for pg_pair in cf.get(section, 'pg_pair_list').split(','):
+            pg_name = pg_pair.split(':')[0].strip()
+            if pg_name not in pgs:
+                plan.add(section, PORTGROUP, pg_name)
+
+    for section in utils.get_children(cf, sections, utils.NFS_INS_PREFIX,
+                                      [vc_item]):
+        ds_name = cf.get(section, 'local_name')
+        for host_name in get_host_names(cf.get(section, 'target_hosts')):
+            host = hosts.get(host_name)
+            if host is None and host_name not in added_hosts:
+                # Reported when applied, like a plain run does
+                continue
+            if host is None or ds_name not in snapshot.host_datastores(host):
+                plan.add(section, NFS, host_name, ds_name)
+    return plan
+
+
+def plan_hosts(cf, section, plan, snapshot, hosts, added_hosts):
+    """Adds the host settings of info_host that differ on each host.
+
+    Like a plain run, this covers every host of the vCenter, not only the
+    hosts of the clusters in config.ini. NTP servers are compared as a
+    set, their order does not matter.
+    """
+    ntp_str = cf.get(utils.INFO_HOST, 'ntp')
+    ntp = utils.get_items(ntp_str)
+    license_key = cf.get(utils.INFO_HOST, 'license')
+    services = utils.get_items(cf.get(utils.INFO_HOST, 'services'))
+    rules = utils.get_items(cf.get(utils.INFO_HOST, 'firewall'))
+    for host_name in sorted(hosts.keys() + added_hosts):
+        if not host_name:
+            continue
+        host = hosts.get(host_name)
+        if ntp and (host is None or
+                    set(snapshot.host_ntp(host)) != set(ntp) or
+                    'ntpd' not in snapshot.host_running_services(host)):
+            plan.add(section, HOST_NTP, host_name, ntp_str)
+        if license_key and (host is None or
+                            snapshot.host_license(host) != license_key):
+            plan.add(section, HOST_LICENSE, host_name, license_key)
+        for service in services:
+            if service == 'ssh' and (
+                    host is None or
+                    'TSM-SSH' not in snapshot.host_running_services(host)):
+                plan.add(section, HOST_SERVICE, host_name, service)
+            if service == 'vmotion' and (
+                    host is None or not snapshot.host_vmotion_enabled(host)):
+                plan.add(section, HOST_SERVICE, host_name, service)
+        enabled_rules = [] if host is None \
+            else snapshot.host_enabled_rules(host)
+        for rule in rules:
+            if rule not in enabled_rules:
+                plan.add(section, HOST_RULE, host_name, rule)
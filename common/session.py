@@ -0,0 +1,48 @@
+"""On-disk cache of vCenter session cookies
+
+Logging in is the most expensive part of a short vc-opt run. The session
+cookie of a successful login is kept in a mode 0600 file keyed by vCenter
+and user so that the next process can reuse the session until it expires.
+"""
+
+import errno
+import hashlib
+import os
+import utils
+
+
+def _get_cache_file(host, user):
+    key = hashlib.sha1('{}@{}'.format(user, host)).hexdigest()
+    return os.path.join(utils.SESSION_CACHE_DIR, key)
+
+
+def load_cookie(host, user):
+    """Returns the cached session cookie, None if there is none."""
+    try:
+        with open(_get_cache_file(host, user)) as cache_file:
+            return cache_file.read().strip() or None
+    except IOError:
+        return None
+
+
+def save_cookie(host, user, cookie):
+    """Stores the session cookie readable by the current user only."""
+    try:
+        os.makedirs(utils.SESSION_CACHE_DIR, 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    path = _get_cache_file(host, user)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    # Existing files keep their mode on open, enforce it explicitly
+    os.fchmod(fd, 0600)
+    with os.fdopen(fd, 'w') as cache_file:
+        cache_file.write(cookie)
+
+
+def clear_cookie(host, user):
+    try:
+        os.remove(_get_cache_file(host, user))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
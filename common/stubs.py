@@ -0,0 +1,269 @@
+"""Stub adapters wrapping pyVmomi.SoapStubAdapter
+
+The adapters here sit between managed objects and the SOAP stubs. They
+pass themselves as outerStub so every managed object returned by a call
+is bound to the wrapper again, not to the inner stub that served it.
+
+Like SoapStubAdapter, an adapter called with an outerStub returns the raw
+(status, obj) pair and leaves raising faults to the outer stub; called
+directly, it returns obj on success and raises it otherwise.
+"""
+
+import errno
+import fcntl
+import os
+import Queue
+import struct
+import threading
+import time
+from pyVmomi.SoapAdapter import StubAdapterBase
+import utils
+
+
+def get_result(status, obj, outerStub):
+    """Returns what an adapter answers for an inner (status, obj) pair."""
+    if outerStub is not None:
+        return status, obj
+    if status == 200:
+        return obj
+    raise obj
+
+
+class PooledStub(StubAdapterBase):
+    """Dispatches calls over a bounded pool of SOAP stubs.
+
+    A single SoapStubAdapter serializes all traffic of the threads using
+    it. This adapter hands every call to an idle stub of the pool, creating
+    stubs lazily up to the pool size, and keeps the session cookie shared
+    so a login through any stub authenticates all of them.
+
+    Long polls such as the WaitForUpdatesEx of task.TaskWatcher hold their
+    stub until the server answers. They are served by stubs kept outside
+    the pool, so they never hold up the other calls.
+    """
+
+    LONG_POLLS = ('WaitForUpdates', 'WaitForUpdatesEx')
+
+    def __init__(self, create_stub, size=10):
+        """
+        @param create_stub: callable returning a new SoapStubAdapter
+        @param size: maximum number of stubs, i.e. parallel requests
+        """
+        stub = create_stub()
+        StubAdapterBase.__init__(self, version=stub.version)
+        self.create_stub = create_stub
+        self.size = max(size, 1)
+        self.lock = threading.Lock()
+        self.idle = Queue.LifoQueue()
+        self.idle.put(stub)
+        self.created = 1
+        self.cookie = stub.cookie
+        # Idle stubs of the long polls, one per concurrent long poll
+        self.idle_polls = []
+
+    def _acquire(self, long_poll=False):
+        with self.lock:
+            if long_poll:
+                if self.idle_polls:
+                    return self.idle_polls.pop()
+                return self.create_stub()
+            if self.idle.empty() and self.created < self.size:
+                self.created += 1
+                return self.create_stub()
+        return self.idle.get()
+
+    def _release(self, stub, long_poll=False):
+        if long_poll:
+            with self.lock:
+                self.idle_polls.append(stub)
+        else:
+            self.idle.put(stub)
+
+    def InvokeMethod(self, mo, info, args, outerStub=None):
+        long_poll = info.wsdlName in self.LONG_POLLS
+        stub = self._acquire(long_poll)
+        try:
+            cookie = self.cookie
+            stub.cookie = cookie
+            status, obj = stub.InvokeMethod(mo, info, args,
+                                            outerStub or self)
+        finally:
+            if stub.cookie != cookie:
+                # Login or session renewal, share the new session
+                self.cookie = stub.cookie
+            self._release(stub, long_poll)
+        return get_result(status, obj, outerStub)
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket refilled at rate tokens per second.
+
+    A take never fails: it borrows the token and sleeps until the bucket
+    would have refilled it, so callers are served in arrival order with
+    one lock round trip each.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        @param rate: tokens per second
+        @param burst: tokens that can be taken at once, rate by default
+        """
+        self.rate = float(rate)
+        self.burst = max(burst or self.rate, 1.0)
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.stamp = time.time()
+
+    def _borrow(self, tokens, stamp, now):
+        """Returns the tokens left after taking one and the seconds to
+        wait for it.
+        """
+        tokens = min(self.burst,
+                     tokens + max(now - stamp, 0.0) * self.rate) - 1
+        if tokens < 0:
+            return tokens, -tokens / self.rate
+        return tokens, 0.0
+
+    def take(self):
+        """Takes one token, sleeping until it is available.
+
+        @return seconds waited
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens, wait = self._borrow(self.tokens, self.stamp, now)
+            self.stamp = now
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket kept in a local file, shared by every process using
+    the same path.
+
+    The file holds the tokens left and the time they were counted, read
+    and written under an exclusive flock.
+    """
+
+    RECORD = struct.Struct('dd')
+
+    def __init__(self, path, rate, burst=None):
+        TokenBucket.__init__(self, rate, burst)
+        self.path = path
+        try:
+            os.makedirs(os.path.dirname(path), 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+
+    def take(self):
+        # flock does not exclude the threads sharing the descriptor
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                data = os.read(self.fd, self.RECORD.size)
+                if len(data) == self.RECORD.size:
+                    tokens, stamp = self.RECORD.unpack(data)
+                else:
+                    tokens, stamp = self.burst, now
+                tokens, wait = self._borrow(tokens, stamp, now)
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                os.write(self.fd, self.RECORD.pack(tokens, max(stamp, now)))
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+# Buckets by (vCenter host, budget, rate), shared by the sessions of a
+# process
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class RateLimit(object):
+    """Request budgets of one vCenter"""
+
+    def __init__(self, calls=None, tasks=None, shared=False):
+        """
+        @param calls: SOAP calls per second, None for no limit
+        @param tasks: task submissions per second, None for no limit;
+        submissions also count as calls
+        @param shared: share the budgets with the other processes of
+        this machine through files in utils.RATE_DIR. A budget is kept per
+        rate, so only processes configured with the same rate share it.
+        """
+        self.calls = calls
+        self.tasks = tasks
+        self.shared = shared
+
+    def get_bucket(self, host, budget):
+        rate = getattr(self, budget)
+        if not rate:
+            return None
+        key = (host, budget, rate, self.shared)
+        with _buckets_lock:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                if self.shared:
+                    bucket = SharedTokenBucket(os.path.join(
+                        utils.RATE_DIR,
+                        '{}.{}.{:g}'.format(host, budget, rate)), rate)
+                else:
+                    bucket = TokenBucket(rate)
+                _buckets[key] = bucket
+            return bucket
+
+
+class RateLimitedStub(StubAdapterBase):
+    """Delays calls to keep within the RateLimit of a vCenter.
+
+    Every call takes a token of the calls budget, and methods starting a
+    task one of the tasks budget as well. Property reads go through
+    InvokeMethod too, so they are counted like any call.
+    """
+
+    def __init__(self, stub, rate_limit, host):
+        """
+        @param stub: SoapStubAdapter or PooledStub serving the calls
+        @param rate_limit: RateLimit instance
+        @param host: vCenter the budgets are kept for
+        """
+        StubAdapterBase.__init__(self, version=stub.version)
+        self.stub = stub
+        self.calls = rate_limit.get_bucket(host, 'calls')
+        self.tasks = rate_limit.get_bucket(host, 'tasks')
+        self.lock = threading.Lock()
+        # Counters
+        self.call_count = 0
+        self.task_count = 0
+        self.delayed = 0
+        self.waited = 0.0
+
+    def InvokeMethod(self, mo, info, args, outerStub=None):
+        is_task = info.wsdlName.endswith('_Task')
+        wait = 0.0
+        if self.calls is not None:
+            wait += self.calls.take()
+        if is_task and self.tasks is not None:
+            wait += self.tasks.take()
+        with self.lock:
+            self.call_count += 1
+            if is_task:
+                self.task_count += 1
+            if wait:
+                self.delayed += 1
+                self.waited += wait
+        status, obj = self.stub.InvokeMethod(mo, info, args,
+                                             outerStub or self)
+        return get_result(status, obj, outerStub)
+
+    def stats(self):
+        with self.lock:
+            return {'calls': self.call_count, 'tasks': self.task_count,
+                    'delayed': self.delayed, 'waited': self.waited}
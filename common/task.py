@@ -12,6 +12,8 @@ This module provies synchronization of client/server operations since
 many vIM operations return 'tasks' which can have varying completion
 times.
 """
+import threading
+import time
 from pyVmomi import vmodl, vim
 
 
@@ -27,6 +29,18 @@ class TaskBlocked(Exception):
     pass
 
 
+#
+# @brief Exception class to represent when the watcher of a task went away
+# before the task completed (e.g.: the session was disconnected).
+#
+class TaskWatcherDestroyed(Exception):
+    """
+    Exception class to represent when the watcher of a task went away
+    before the task completed.
+    """
+    pass
+
+
 #
 # TaskUpdates
 #     verbose information about task progress
@@ -51,11 +65,336 @@ def SetTasksVerbose(verbose=True):
         globalTaskUpdate = None
 
 
+# Task properties watched by the filters. Entity and description do not
+# change and are only sent with the first update.
+TASK_PATH_SET = ['info.state', 'info.progress', 'info.error', 'info.result',
+                 'info.entity', 'info.descriptionId']
+
+# Tasks whose VM is not checked for pending questions
+NO_QUESTION_TASKS = ['VirtualMachine.destroy']
+
+
+#
+# @brief Completion handle of a task registered with a TaskWatcher.
+#
+class TaskFuture(object):
+    """
+    Completion handle of a task registered with a TaskWatcher. Done
+    callbacks are called with the future from the watcher thread.
+    """
+
+    def __init__(self, task, onProgressUpdate=None):
+        self.task = task
+        self.state = None
+        self.error = None
+        self.exception = None
+        # Result of a successful task, e.g. the objects it created
+        self.result = None
+        # Task properties as received in the change sets
+        self.info = {}
+        self.entity = None
+        # Whether the task was seen waiting in the vCenter task queue
+        self.queued = False
+        self.progressUpdater = ProgressUpdater(task, onProgressUpdate)
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+
+    def Done(self):
+        return self.event.is_set()
+
+    def AddDoneCallback(self, callback):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def Wait(self, timeout=None):
+        """
+        Block until the task completes and return its state. Errors of
+        the watcher itself (e.g. TaskBlocked) are raised.
+        """
+        self.event.wait(timeout)
+        if self.exception is not None:
+            raise self.exception
+        return self.state
+
+    def Finish(self, state, error=None, exception=None, result=None):
+        if state == vim.TaskInfo.State.error:
+            self.progressUpdater.Update('error: %s' % str(error))
+        elif exception is None:
+            self.progressUpdater.Update('completed')
+        with self.lock:
+            self.state = state
+            self.error = error
+            self.exception = exception
+            self.result = result
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+#
+# @brief Tracks any number of tasks of a session with a single property
+# collector filter and a single long-poll loop.
+#
+class TaskWatcher(object):
+    """
+    Tracks any number of tasks of a session with a single property
+    collector filter and a single long-poll loop. Tasks are added to a
+    ListView the filter traverses; the poll thread runs only while tasks
+    are pending. Failed polls are retried with backoff; pending tasks are
+    failed when the session is lost, the watcher is destroyed or no poll
+    succeeded for MAX_FAILURE_SECONDS.
+    """
+
+    # Seconds each WaitForUpdatesEx call may block on the server
+    POLL_SECONDS = 60
+    # Backoff between failed polls, doubled up to the maximum
+    RETRY_SECONDS = 1
+    MAX_RETRY_SECONDS = 30
+    # Seconds without a successful poll before pending tasks are failed
+    MAX_FAILURE_SECONDS = 300
+
+    def __init__(self, si):
+        content = si.RetrieveContent()
+        self.pc = content.propertyCollector.CreatePropertyCollector()
+        self.view = content.viewManager.CreateListView()
+        self.filter = self.pc.CreateFilter(
+            CreateListViewFilterSpec(self.view), True)
+        self.lock = threading.Lock()
+        self.futures = {}
+        # VMs watched for pending questions and the futures needing them
+        self.entities = {}
+        self.version = ''
+        self.thread = None
+        self.destroyed = False
+        # ListView changes not applied yet because ModifyListView failed
+        self.added = []
+        self.removed = []
+
+    def Watch(self, task, onProgressUpdate=None):
+        """
+        Register a task and return its TaskFuture.
+        """
+        future = TaskFuture(task, onProgressUpdate)
+        future.progressUpdater.Update('created')
+        with self.lock:
+            self.futures[task] = future
+        try:
+            self.view.ModifyListView(add=[task])
+        except Exception:
+            with self.lock:
+                self.futures.pop(task, None)
+            raise
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._Run,
+                                               name='TaskWatcher')
+                self.thread.daemon = True
+                self.thread.start()
+        return future
+
+    def _Run(self):
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=self.POLL_SECONDS)
+        retrySeconds = self.RETRY_SECONDS
+        lastSuccess = time.time()
+        while True:
+            with self.lock:
+                if not self.futures or self.destroyed:
+                    self.thread = None
+                    return
+            try:
+                if self.added or self.removed:
+                    self.view.ModifyListView(add=self.added,
+                                             remove=self.removed)
+                    self.added, self.removed = [], []
+                update = self.pc.WaitForUpdatesEx(self.version, options)
+            except vim.fault.NotAuthenticated as e:
+                self._Abort(e)
+                continue
+            except vmodl.query.InvalidCollectorVersion:
+                # Start over from a full update, finished tasks are gone
+                # from the view already
+                self.version = ''
+                lastSuccess = time.time()
+                continue
+            except Exception as e:
+                if self.destroyed:
+                    continue
+                if time.time() - lastSuccess >= self.MAX_FAILURE_SECONDS:
+                    # The server stays unreachable, fail the pending tasks
+                    # with the error instead of waiting forever
+                    self._Abort(e)
+                    retrySeconds = self.RETRY_SECONDS
+                    lastSuccess = time.time()
+                    continue
+                # Transient, e.g. a socket error or timeout: poll again
+                # from the same version
+                time.sleep(retrySeconds)
+                retrySeconds = min(retrySeconds * 2, self.MAX_RETRY_SECONDS)
+                continue
+            retrySeconds = self.RETRY_SECONDS
+            lastSuccess = time.time()
+            if update is None:
+                continue
+            self.version = update.version
+            for filterSet in update.filterSet:
+                for objSet in filterSet.objectSet:
+                    if isinstance(objSet.obj, vim.Task):
+                        self._ApplyTask(objSet, self.added, self.removed)
+                    else:
+                        self._ApplyVm(objSet, self.removed)
+
+    def _ApplyTask(self, objSet, added, removed):
+        """
+        Apply the change set of one task. Everything needed is in the
+        change set, the task itself is never read again.
+        """
+        with self.lock:
+            future = self.futures.get(objSet.obj)
+        if future is None:
+            return
+        for change in objSet.changeSet:
+            future.info[change.name] = change.val
+        state = future.info.get('info.state')
+        if state == vim.TaskInfo.State.queued:
+            future.queued = True
+        if state in (vim.TaskInfo.State.success, vim.TaskInfo.State.error):
+            self._Finish(future, state, future.info.get('info.error'),
+                         result=future.info.get('info.result'))
+            removed.append(future.task)
+            removed.extend(self._ReleaseEntity(future))
+            return
+        entity = future.info.get('info.entity')
+        if future.entity is None and isinstance(entity, vim.VirtualMachine) \
+           and future.info.get('info.descriptionId') not in NO_QUESTION_TASKS:
+            # Watch the VM of the task for pending questions
+            future.entity = entity
+            with self.lock:
+                watching = self.entities.setdefault(entity, [])
+                watching.append(future)
+            if len(watching) == 1:
+                added.append(entity)
+        progress = future.info.get('info.progress')
+        if progress is not None:
+            future.progressUpdater.UpdateIfNeeded(progress)
+
+    def _ApplyVm(self, objSet, removed):
+        """
+        Fail the running tasks of a VM which asks a question.
+        """
+        question = None
+        for change in objSet.changeSet:
+            if change.name == 'runtime.question':
+                question = change.val
+        if question is None:
+            return
+        with self.lock:
+            futures = list(self.entities.get(objSet.obj, []))
+        for future in futures:
+            if future.info.get('info.state') != vim.TaskInfo.State.running:
+                continue
+            self._Finish(future, future.info.get('info.state'),
+                         exception=TaskBlocked(
+                             "Task blocked, User Intervention required"))
+            removed.append(future.task)
+            removed.extend(self._ReleaseEntity(future))
+
+    def _ReleaseEntity(self, future):
+        """
+        Stop watching the VM of a finished task, return the VMs no task
+        needs anymore.
+        """
+        if future.entity is None:
+            return []
+        with self.lock:
+            watching = self.entities.get(future.entity, [])
+            if future in watching:
+                watching.remove(future)
+            if watching:
+                return []
+            self.entities.pop(future.entity, None)
+        return [future.entity]
+
+    def _Finish(self, future, state, error=None, exception=None,
+                result=None):
+        with self.lock:
+            self.futures.pop(future.task, None)
+        future.Finish(state, error, exception, result)
+
+    def _Abort(self, exception, removeFromView=True):
+        """
+        Fail every pending task, e.g. when the session is lost, and stop
+        watching them.
+        """
+        with self.lock:
+            futures = self.futures.values()
+        removed = []
+        for future in futures:
+            self._Finish(future, None, exception=exception)
+            removed.append(future.task)
+            removed.extend(self._ReleaseEntity(future))
+        if removeFromView and removed:
+            try:
+                self.view.ModifyListView(remove=removed)
+            except Exception:
+                # The session is likely gone, retried with the next poll
+                self.removed.extend(removed)
+
+    def Destroy(self):
+        self.destroyed = True
+        # The view is destroyed below with everything it holds
+        self._Abort(TaskWatcherDestroyed("Task watcher destroyed"),
+                    removeFromView=False)
+        self.pc.CancelWaitForUpdates()
+        self.filter.Destroy()
+        self.view.DestroyView()
+        self.pc.DestroyPropertyCollector()
+
+
+# Task watchers of each session, keyed by the stub of the ServiceInstance
+_taskWatchers = {}
+_taskWatchersLock = threading.Lock()
+
+
+def GetTaskWatcher(si):
+    """
+    Return the task watcher of the session, creating it on first use.
+    """
+    with _taskWatchersLock:
+        watcher = _taskWatchers.get(si._stub)
+        if watcher is None:
+            watcher = TaskWatcher(si)
+            _taskWatchers[si._stub] = watcher
+    return watcher
+
+
+def ReleaseTaskWatcher(si):
+    """
+    Destroy the task watcher of the session if there is one.
+    """
+    with _taskWatchersLock:
+        watcher = _taskWatchers.pop(si._stub, None)
+    if watcher is not None:
+        watcher.Destroy()
+
+
+def _GetServiceInstance(si, task):
+    if si is None:
+        si = vim.ServiceInstance("ServiceInstance", task._stub)
+    return si
+
+
 #
 # @param raiseOnError [in] Any exception thrown is thrown up to the caller if
 # raiseOnError is set to true
-# @param si [in] ServiceInstance to use. If set to None, use the default one.
-# @param pc [in] property collector to use else retrieve one from cache
+# @param si [in] ServiceInstance to use. If set to None, use the one of the
+# task.
+# @param pc [in] Unused, the session's TaskWatcher owns its own collector
 # @param onProgressUpdate [in] callable to call with task progress updates.
 #   For example:
 #
@@ -82,8 +421,7 @@ def WaitForTask(task,
     @param raiseOnError      : Any exception thrown is thrown up to the caller
                               if raiseOnError is set to true.
     @type  pc                : ManagedObjectReference to a PropertyCollector.
-    @param pc                : Property collector to use. If None, get it from
-                              the ServiceInstance.
+    @param pc                : Unused, kept for compatibility.
     @type  onProgressUpdate  : callable
     @param onProgressUpdate  : Callable to call with task progress updates.
 
@@ -92,31 +430,41 @@ def WaitForTask(task,
             def OnTaskProgressUpdate(task, percentDone):
                 print 'Task %s is %d%% complete.' % (task, percentDone)
     """
-    if pc is None:
-        pc = si.content.propertyCollector
+    si = _GetServiceInstance(si, task)
+    future = GetTaskWatcher(si).Watch(task, onProgressUpdate)
+    state = future.Wait()
 
-    progressUpdater = ProgressUpdater(task, onProgressUpdate)
-    progressUpdater.Update('created')
+    if state == vim.TaskInfo.State.error:
+        if raiseOnError:
+            raise future.error
+        else:
+            print "Task reported error: " + str(future.error.msg)
+    return state
 
-    filter = CreateFilter(pc, task)
 
-    version, state = None, None
-    # Loop looking for updates till the state moves to a completed state.
-    while state not in (vim.TaskInfo.State.success, vim.TaskInfo.State.error):
-        version, state = GetTaskStatus(task, version, pc)
-        progressUpdater.UpdateIfNeeded()
+def WaitForTaskResult(task, si=None, onProgressUpdate=None):
+    """
+    Wait for task to complete and return its info.result, taken from the
+    change sets instead of reading the task again. Task errors are raised.
+    """
+    si = _GetServiceInstance(si, task)
+    future = GetTaskWatcher(si).Watch(task, onProgressUpdate)
+    if future.Wait() == vim.TaskInfo.State.error:
+        raise future.error
+    return future.result
 
-    filter.Destroy()
 
-    if state == "error":
-        progressUpdater.Update('error: %s' % str(task.info.error))
-        if raiseOnError:
-            raise task.info.error
-        else:
-            print "Task reported error: " + str(task.info.error.msg)
-    else:
-        progressUpdater.Update('completed')
-    return state
+def WaitForTaskError(task, si=None, onProgressUpdate=None):
+    """
+    Wait for task to complete and return its error, None on success. The
+    error is printed like WaitForTask does when raiseOnError is unset.
+    """
+    si = _GetServiceInstance(si, task)
+    future = GetTaskWatcher(si).Watch(task, onProgressUpdate)
+    if future.Wait() == vim.TaskInfo.State.error:
+        print "Task reported error: " + str(future.error.msg)
+        return future.error
+    return None
 
 
 # Wait for multiple tasks to complete
@@ -137,74 +485,21 @@ def WaitForTasks(tasks,
     if not tasks:
         return
 
-    if pc is None:
-        pc = si.content.propertyCollector
-
-    progressUpdaters = {}
-    for task in tasks:
-        progressUpdater = ProgressUpdater(task, onProgressUpdate)
-        progressUpdater.Update('created')
-        progressUpdaters[str(task)] = progressUpdater
-
-    filter = CreateTasksFilter(pc, tasks)
-
-    try:
-        version, state = None, None
-
-        # Loop looking for updates till the state moves to a completed state.
-        while len(progressUpdaters):
-            update = pc.WaitForUpdates(version)
-            for filterSet in update.filterSet:
-                for objSet in filterSet.objectSet:
-                    task = objSet.obj
-                    taskId = str(task)
-                for change in objSet.changeSet:
-                    if change.name == 'info':
-                        state = change.val.state
-                    elif change.name == 'info.state':
-                        state = change.val
-                    else:
-                        continue
-
-                    progressUpdater = progressUpdaters.get(taskId)
-                    if not progressUpdater:
-                        continue
-
-                    if state == vim.TaskInfo.State.success:
-                        progressUpdater.Update('completed')
-                        progressUpdaters.pop(taskId)
-                    elif state == vim.TaskInfo.State.error:
-                        err = task.info.error
-                        progressUpdater.Update('error: %s' % str(err))
-                        if raiseOnError:
-                            raise err
-                        else:
-                            print "Task %s reported error: %s" % (taskId,
-                                                                  str(err))
-                            progressUpdaters.pop(taskId)
-                    else:
-                        if onProgressUpdate:
-                            progressUpdater.UpdateIfNeeded()
-            # Move to next version
-            version = update.version
-    finally:
-        if filter:
-            filter.Destroy()
+    si = _GetServiceInstance(si, tasks[0])
+    watcher = GetTaskWatcher(si)
+    futures = [watcher.Watch(task, onProgressUpdate) for task in tasks]
+
+    for future in futures:
+        state = future.Wait()
+        if state == vim.TaskInfo.State.error:
+            if raiseOnError:
+                raise future.error
+            else:
+                print "Task %s reported error: %s" % (str(future.task),
+                                                      str(future.error))
     return
 
 
-def GetTaskStatus(task, version, pc):
-    update = pc.WaitForUpdates(version)
-    state = task.info.state
-
-    if state == 'running' and \
-       task.info.name is not None and \
-       task.info.name.info.name != "Destroy":
-        CheckForQuestionPending(task)
-
-    return update.version, state
-
-
 def CreateFilter(pc, task):
     """ Create property collector filter for task """
     return CreateTasksFilter(pc, [task])
@@ -221,7 +516,7 @@ def CreateTasksFilter(pc, tasks):
 
     # Next, create the property specification as the state.
     propspec = vmodl.query.PropertyCollector.PropertySpec(
-        type=vim.Task, pathSet=[], all=True)
+        type=vim.Task, pathSet=TASK_PATH_SET, all=False)
 
     # Create a filter spec with the specified object and property spec.
     filterspec = vmodl.query.PropertyCollector.FilterSpec()
@@ -232,6 +527,22 @@ def CreateTasksFilter(pc, tasks):
     return pc.CreateFilter(filterspec, True)
 
 
+def CreateListViewFilterSpec(view):
+    """
+    Create filter spec for the tasks and task VMs held by a list view
+    """
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseTasks', path='view', skip=False, type=vim.view.ListView)
+    objspec = vmodl.query.PropertyCollector.ObjectSpec(
+        obj=view, skip=True, selectSet=[traversal])
+    taskspec = vmodl.query.PropertyCollector.PropertySpec(
+        type=vim.Task, pathSet=TASK_PATH_SET, all=False)
+    vmspec = vmodl.query.PropertyCollector.PropertySpec(
+        type=vim.VirtualMachine, pathSet=['runtime.question'], all=False)
+    return vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[objspec], propSet=[taskspec, vmspec])
+
+
 def CheckForQuestionPending(task):
     """
     Check to see if VM needs to ask a question, throw exception
@@ -268,8 +579,10 @@ class ProgressUpdater(object):
         if taskUpdate:
             taskUpdate(self.task, state)
 
-    def UpdateIfNeeded(self):
-        self.progress = self.task.info.progress
+    def UpdateIfNeeded(self, progress=None):
+        if progress is None:
+            progress = self.task.info.progress
+        self.progress = progress
 
         if self.progress != self.prevProgress:
             self.Update(self.progress)
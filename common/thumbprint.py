@@ -0,0 +1,118 @@
+"""SSL thumbprints of ESXi hosts
+
+Thumbprints are read in-process with the ssl module, in parallel and with
+a per host timeout, and kept in a persistent host -> SHA1 cache. Cached
+values are trusted until vCenter reports a mismatch, the caller then asks
+for a refresh of that host.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import socket
+import ssl
+import threading
+import threadpool
+import utils
+
+
+_cache_lock = threading.Lock()
+
+
+def _load_cache():
+    try:
+        with open(utils.THUMBPRINT_CACHE_FILE) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(utils.THUMBPRINT_CACHE_FILE), 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    tmp_path = utils.THUMBPRINT_CACHE_FILE + '.tmp'
+    with open(tmp_path, 'w') as cache_file:
+        json.dump(cache, cache_file, indent=1, sort_keys=True)
+    os.rename(tmp_path, utils.THUMBPRINT_CACHE_FILE)
+
+
+def fetch_thumbprint(host_name, port=443, timeout=10):
+    """Reads the SHA1 thumbprint of the host certificate.
+
+    @param host_name: ip or fqdn of the host
+    @return thumbprint as AA:BB:..., None if the host is unreachable
+    """
+    try:
+        sock = socket.create_connection((host_name, port), timeout)
+    except (socket.error, socket.timeout) as e:
+        print 'Failed to connect to host {}: {}'.format(host_name, e)
+        return None
+    try:
+        # ssl.wrap_socket rather than an SSLContext, which needs 2.7.9
+        ssl_sock = ssl.wrap_socket(sock, cert_reqs=ssl.CERT_NONE)
+        try:
+            der_cert = ssl_sock.getpeercert(binary_form=True)
+        finally:
+            ssl_sock.close()
+    except (socket.error, ssl.SSLError) as e:
+        print 'Failed to get certificate of host {}: {}'.format(host_name, e)
+        return None
+    finally:
+        sock.close()
+    digest = hashlib.sha1(der_cert).hexdigest().upper()
+    return ':'.join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+
+def get_thumbprints(host_names, refresh=False, concurrency=16, timeout=10):
+    """Returns the thumbprints of hosts, fetching uncached ones in parallel.
+
+    @param host_names: list of host ip or fqdn
+    @param refresh: fetch again even if cached, e.g. after a mismatch
+    @param concurrency: maximum number of hosts contacted at once
+    @param timeout: seconds to wait for each host
+    @return dict host name -> thumbprint, None for unreachable hosts
+    """
+    with _cache_lock:
+        cache = _load_cache()
+    thumbprints = {}
+    missing = []
+    for host_name in host_names:
+        if not refresh and host_name in cache:
+            thumbprints[host_name] = cache[host_name]
+        elif host_name not in missing:
+            missing.append(host_name)
+    if not missing:
+        return thumbprints
+
+    if len(missing) == 1:
+        thumbprints[missing[0]] = fetch_thumbprint(missing[0],
+                                                   timeout=timeout)
+    else:
+        def store(request, thumbprint):
+            thumbprints[request.args[0]] = thumbprint
+
+        pool_size = min(concurrency, len(missing))
+        pool = threadpool.ThreadPool(pool_size)
+        for host_name in missing:
+            pool.putRequest(threadpool.WorkRequest(
+                fetch_thumbprint, args=(host_name,),
+                kwds={'timeout': timeout}, callback=store))
+        pool.wait()
+        # Idle workers exit on their own once their queue poll times out
+        pool.dismissWorkers(pool_size)
+
+    with _cache_lock:
+        cache = _load_cache()
+        for host_name in missing:
+            if thumbprints.get(host_name):
+                cache[host_name] = thumbprints[host_name]
+        _save_cache(cache)
+    return thumbprints
+
+
+def get_thumbprint(host_name, refresh=False):
+    return get_thumbprints([host_name], refresh).get(host_name)
@@ -1,5 +1,15 @@
+import os
+
 CONFIG_FILE_PATH = '/usr/local/data/config.ini'
 SCHEDULAR_FILE_PATH = '/usr/local/data/monkey.ini'
+# Per user cache of vCenter session cookies
+SESSION_CACHE_DIR = os.path.expanduser('~/.vcconfig/sessions')
+# Per user cache of ESXi host SSL thumbprints
+THUMBPRINT_CACHE_FILE = os.path.expanduser('~/.vcconfig/thumbprints.json')
+# Journals of completed vc-cfg steps
+JOURNAL_DIR = os.path.expanduser('~/.vcconfig/journal')
+# Request budgets shared between processes, one file per vCenter
+RATE_DIR = os.path.expanduser('~/.vcconfig/rates')
 
 INFO_VC = 'info_vc'
 INFO_HOST = 'info_host'
@@ -51,6 +61,13 @@ def get_items(items_str, flag=','):
     return [item.strip() for item in items_list]
 
 
+def get_children(cf, sections, prefix, parents):
+    """Returns the config sections of prefix whose parent is in parents."""
+    return [section for section in sections
+            if section.startswith(prefix) and
+            cf.get(section, 'parent') in parents]
+
+
 def get_randstr(size):
     import string
     import random
@@ -1,27 +1,49 @@
 """Wrapper library for pyVmomi"""
 
 import logging
-import re
+import threading
 import pyVmomi
 from pyVmomi import vim
+import inventory
+import session
+import stubs
 import task
 
 
 LOG = logging.getLogger(__name__)
 
 
-def connect(host, user, password):
-    stub = pyVmomi.SoapStubAdapter(
-        host=host,
-        port=443,
-        version='vim.version.version6',
-        path='/sdk',
-        certKeyFile=None,
-        certFile=None)
-
-    si = vim.ServiceInstance("ServiceInstance", stub)
+def connect(host, user, password, reuse_session=False, pool_size=None,
+            rate_limit=None):
+    def create_stub():
+        return pyVmomi.SoapStubAdapter(
+            host=host,
+            port=443,
+            version='vim.version.version6',
+            path='/sdk',
+            certKeyFile=None,
+            certFile=None)
+
+    if pool_size:
+        stub = stubs.PooledStub(create_stub, pool_size)
+    else:
+        stub = create_stub()
+    si_stub = stub
+    if rate_limit is not None:
+        si_stub = stubs.RateLimitedStub(stub, rate_limit, host)
+
+    si = vim.ServiceInstance("ServiceInstance", si_stub)
     content = si.RetrieveContent()
+    if reuse_session:
+        cookie = session.load_cookie(host, user)
+        if cookie:
+            stub.cookie = cookie
+            if content.sessionManager.currentSession is not None:
+                return si
+            LOG.debug('Cached session for %s@%s expired', user, host)
     content.sessionManager.Login(user, password, None)
+    if reuse_session:
+        session.save_cookie(host, user, stub.cookie)
     return si
 
 
@@ -30,6 +52,26 @@ def disconnect(si):
     content.sessionManager.Logout()
 
 
+# Properties prefetched for VM regex matching and status filtering
+VM_PATH_SET = ['name', 'runtime.powerState']
+
+
+def match_vms(si, snapshot, regex_list, status=None):
+    """Returns VM wrappers for snapshot entries matching any regex.
+
+    @param snapshot: list of (vim.VirtualMachine, property dict) tuples
+    fetched with VM_PATH_SET
+    @param regex_list: list of regular expressions for the vm name
+    @param status: optional power state the vms must be in
+    """
+    import utils
+    props_filter = None
+    if status is not None and status in utils.VM_STATUS:
+        props_filter = {'runtime.powerState': status}
+    return [VM(si, vm, props) for vm, props
+            in inventory.match_regex(snapshot, regex_list, props_filter)]
+
+
 class ManagedObject(object):
 
     def __enter__(self):
@@ -38,21 +80,42 @@ class ManagedObject(object):
     def __exit__(self, *exc_info):
         self.disconnect()
 
+    def release(self):
+        """Destroys the views and collectors created in the session and
+        keeps the session logged in.
+        """
+        if self.si is not None:
+            task.ReleaseTaskWatcher(self.si)
+            inventory.release_views(self.si)
+
     def disconnect(self):
         if self.si is not None:
+            self.release()
             disconnect(self.si)
             self.si = None
 
     def get_root_folder(self, si):
         return si.RetrieveContent().rootFolder
 
+    def get_view(self, si, vimtype, container=None):
+        """
+        Get the session's shared recursive view of the given types
+        """
+        return inventory.get_view_manager(si).get_view(vimtype, container)
+
     def get_obj(self, si, vimtype, name):
         """
         Get the vsphere object associated with a given text name
+
+        Served from the session's name index when it covers the types, so
+        a hit may be up to InventoryIndex.max_age seconds old.
         """
+        index = inventory.get_index(si)
+        if index is not None and index.covers(vimtype):
+            objs = index.lookup(vimtype, name)
+            return objs[0] if objs else None
         obj = None
-        container = si.RetrieveContent().viewManager.\
-            CreateContainerView(si.RetrieveContent().rootFolder, vimtype, True)
+        container = self.get_view(si, vimtype)
         for c in container.view:
             if c.name == name:
                 obj = c
@@ -62,11 +125,25 @@ class ManagedObject(object):
 
 class VirtualCenter(ManagedObject):
 
-    def __init__(self, host, user, pwd):
+    # Managed types tracked by the name index
+    INDEX_TYPES = [vim.Datacenter, vim.ClusterComputeResource,
+                   vim.HostSystem, vim.VirtualMachine, vim.VirtualApp,
+                   vim.ResourcePool, vim.Datastore, vim.Network,
+                   vim.DistributedVirtualSwitch, vim.Folder]
+
+    def __init__(self, host, user, pwd, use_index=False, reuse_session=False,
+                 pool_size=None, rate_limit=None):
         self.host = host
         self.user = user
         self.pwd = pwd
         self.si = None
+        self.use_index = use_index
+        self.reuse_session = reuse_session
+        self.pool_size = pool_size
+        self.rate_limit = rate_limit
+        self.index = None
+        self.connect_lock = threading.Lock()
+        self.index_lock = threading.Lock()
 
     def requires_connection(func):
         """Decorator that makes sure that we have active connection to virtual
@@ -78,10 +155,56 @@ class VirtualCenter(ManagedObject):
 
         def connect_me(self, *args, **kargs):
             if self.si is None:
-                self.si = connect(self.host, self.user, self.pwd)
+                with self.connect_lock:
+                    if self.si is None:
+                        self.si = connect(self.host, self.user, self.pwd,
+                                          self.reuse_session, self.pool_size,
+                                          self.rate_limit)
             return func(self, *args, **kargs)
         return connect_me
 
+    def release(self):
+        if self.index is not None:
+            inventory.unregister_index(self.si)
+            self.index.destroy()
+            self.index = None
+        ManagedObject.release(self)
+
+    def disconnect(self):
+        if self.si is not None and self.reuse_session:
+            session.clear_cookie(self.host, self.user)
+        ManagedObject.disconnect(self)
+
+    def get_index(self):
+        """Returns the live name index, building it on first use.
+
+        @return inventory.InventoryIndex instance
+        """
+        if self.index is None:
+            with self.index_lock:
+                if self.index is None:
+                    invtvw = self.get_view(self.si, self.INDEX_TYPES)
+                    index = inventory.InventoryIndex(self.si, invtvw,
+                                                     self.INDEX_TYPES)
+                    inventory.register_index(self.si, index)
+                    self.index = index
+        return self.index
+
+    def open_views(self):
+        """Returns the number of container views held by this session."""
+        if self.si is None:
+            return 0
+        return inventory.get_view_manager(self.si).count()
+
+    def rate_stats(self):
+        """Returns the counters of the rate limit of this session, None when
+        its calls are not limited.
+        """
+        if self.si is None or \
+                not isinstance(self.si._stub, stubs.RateLimitedStub):
+            return None
+        return self.si._stub.stats()
+
     @requires_connection
     def assign_role(self, user, role_name):
         authmgr = self.si.RetrieveContent().authorizationManager
@@ -121,6 +244,46 @@ class VirtualCenter(ManagedObject):
         dc = rootFolder.CreateDatacenter(name)
         return Datacenter(self.si, dc)
 
+    @requires_connection
+    def get_inventory(self, vimtype, path_set=None):
+        """Snapshots properties of all objects of a type in one round trip.
+
+        @param vimtype: managed object type, e.g. vim.VirtualMachine
+        @param path_set: property paths to fetch, ['name'] by default
+        @return list of (managed object, property dict) tuples
+        """
+        invtvw = self.get_view(self.si, [vimtype])
+        return inventory.collect_properties(self.si, invtvw, vimtype,
+                                            path_set)
+
+    @requires_connection
+    def get_inventory_snapshot(self, path_sets):
+        """Snapshots properties of several types in one round trip.
+
+        @param path_sets: list of (managed object type, property paths)
+        @return list of (managed object, property dict) tuples
+        """
+        invtvw = self.get_view(self.si, [vimtype for vimtype, _ in path_sets])
+        return inventory.collect_types(self.si, invtvw, path_sets)
+
+    @requires_connection
+    def find_by_name(self, vimtype, name):
+        """Returns all managed objects of a type with the given name.
+
+        Served from the live name index when enabled and the type is
+        indexed, otherwise from an inventory snapshot. Index hits may be
+        up to InventoryIndex.max_age seconds old, so an object destroyed
+        or renamed meanwhile can still be returned; misses are always
+        current.
+        @param vimtype: managed object type, e.g. vim.HostSystem
+        @param name: name of the objects
+        @return list of managed objects
+        """
+        if self.use_index and self.get_index().covers([vimtype]):
+            return self.get_index().lookup([vimtype], name)
+        return [obj for obj, props in self.get_inventory(vimtype)
+                if props.get('name') == name]
+
     @requires_connection
     def get_datacenter_by_name(self, name):
         """Returns a reference to datacenter in the root folder.
@@ -128,14 +291,8 @@ class VirtualCenter(ManagedObject):
         @param name: name of the datacenter
         @return returns Datacenter instance
         """
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.Datacenter],
-            recursive=True)
-        for dc in invtvw.view:
-            if dc.name == name:
-                return Datacenter(self.si, dc)
+        for dc in self.find_by_name(vim.Datacenter, name):
+            return Datacenter(self.si, dc)
         print 'Datacenter {} not exist on VC'.format(name)
         return None
 
@@ -146,79 +303,46 @@ class VirtualCenter(ManagedObject):
         @param name: name of the vm
         @return returns VirtualMachine instance
         """
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.VirtualMachine],
-            recursive=True)
-        for vm in invtvw.view:
-            if vm.name == name:
-                if folder_name and vm.parent.name != folder_name:
-                    continue
-                return VM(self.si, vm)
+        for vm in self.find_by_name(vim.VirtualMachine, name):
+            if folder_name and vm.parent.name != folder_name:
+                continue
+            return VM(self.si, vm, {'name': name})
         print 'VM {} not exist on VC'.format(name)
         return None
 
     @requires_connection
     def get_datastore_by_name(self, name):
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.Datastore],
-            recursive=True)
-        for ds in invtvw.view:
-            if ds.name == name:
-                return DataStore(self.si, ds)
+        for ds in self.find_by_name(vim.Datastore, name):
+            return DataStore(self.si, ds)
         print 'Datastore {} not exist on VC'.format(name)
         return None
 
     @requires_connection
     def get_host_by_name(self, name):
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.HostSystem],
-            recursive=True)
-        for host in invtvw.view:
-            if host.name == name:
-                return Host(self.si, host)
+        for host in self.find_by_name(vim.HostSystem, name):
+            return Host(self.si, host)
         print 'Host {} not exist on VC'.format(name)
         return None
 
     @requires_connection
     def get_vapp_by_name(self, name):
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.VirtualApp],
-            recursive=True)
-        for vapp in invtvw.view:
-            if name in vapp.name:
-                return Vapp(self.si, vapp)
+        for vapp, props in self.get_inventory(vim.VirtualApp):
+            if name in props.get('name', ''):
+                return Vapp(self.si, vapp, props)
         print 'vApp {} not exist on VC'.format(name)
         return None
 
     @requires_connection
     def get_rp_by_name(self, name):
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.ResourcePool],
-            recursive=True)
-        for rp in invtvw.view:
-            if rp.summary.name == name:
-                return ResourcePool(self.si, rp)
+        for rp in self.find_by_name(vim.ResourcePool, name):
+            return ResourcePool(self.si, rp)
         print 'ResourcePool {} not exist on VC'.format(name)
         return None
 
     @requires_connection
     def get_log_bundle(self):
         def get_all_host_systems():
-            vmgr = self.si.RetrieveContent().viewManager
-            invtvw = vmgr.CreateContainerView(
-                container=self.get_root_folder(self.si),
-                type=[vim.HostSystem],
-                recursive=True)
+            invtvw = self.get_view(self.si, [vim.HostSystem])
             return [h for h in invtvw.view]
 
         content = self.si.RetrieveContent()
@@ -226,101 +350,71 @@ class VirtualCenter(ManagedObject):
         generate_task = dmgr.GenerateLogBundles_Task(
             includeDefault=True,
             host=get_all_host_systems())
-        task.WaitForTask(generate_task, self.si)
         bundles = [b.url.replace("*", self.host)
-                   for b in generate_task.info.result]
+                   for b in task.WaitForTaskResult(generate_task, self.si)]
         return bundles
 
     @requires_connection
     def get_datacenters(self):
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.Datacenter],
-            recursive=True)
+        invtvw = self.get_view(self.si, [vim.Datacenter])
         return [Datacenter(self.si, dc) for dc in invtvw.view]
 
     @requires_connection
     def get_hosts(self):
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.HostSystem],
-            recursive=True)
+        invtvw = self.get_view(self.si, [vim.HostSystem])
         return [Host(self.si, host) for host in invtvw.view]
 
+    @requires_connection
+    def get_hosts_by_names(self, names):
+        """Resolves host names in one round trip.
+
+        @param names: list of host names
+        @return dict name -> Host instance for the hosts found
+        """
+        if self.use_index:
+            return dict((name, Host(self.si, hosts[0], {'name': name}))
+                        for name, hosts in
+                        ((name, self.find_by_name(vim.HostSystem, name))
+                         for name in names) if hosts)
+        wanted = set(names)
+        return dict((name, Host(self.si, host, {'name': name}))
+                    for host, name in self.get_host_names() if name in wanted)
+
+    @requires_connection
+    def get_host_names(self):
+        """Returns (vim.HostSystem, name) of all hosts in one round trip."""
+        return [(host, props.get('name')) for host, props
+                in self.get_inventory(vim.HostSystem)]
+
     @requires_connection
     def get_vms_by_regex(self, regex_list, status=None):
-        all_vms = []
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.VirtualMachine],
-            recursive=True)
-        for regex in regex_list:
-            for vm in invtvw.view:
-                if re.match(regex, vm.name):
-                    all_vms.append(VM(self.si, vm))
-        if status is not None:
-            import utils
-            if status in utils.VM_STATUS:
-                for vm in all_vms:
-                    if vm.get_state() != status:
-                        all_vms.remove(vm)
-        return all_vms
+        snapshot = self.get_inventory(vim.VirtualMachine, VM_PATH_SET)
+        return match_vms(self.si, snapshot, regex_list, status)
 
     @requires_connection
     def get_nets_by_regex(self, regex_list):
-        all_nets = []
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.Network],
-            recursive=True)
-        for regex in regex_list:
-            for net in invtvw.view:
-                if re.match(regex, net.name):
-                    all_nets.append(Network(self.si, net))
-        return all_nets
+        snapshot = self.get_inventory(vim.Network)
+        return [Network(self.si, net, props) for net, props
+                in inventory.match_regex(snapshot, regex_list)]
 
     @requires_connection
     def get_folders_by_regex(self, regex_list):
-        all_folders = []
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.Folder],
-            recursive=True)
-        for regex in regex_list:
-            for folder in invtvw.view:
-                if re.match(regex, folder.name):
-                    all_folders.append(Folder(self.si, folder))
-        return all_folders
+        snapshot = self.get_inventory(vim.Folder)
+        return [Folder(self.si, folder, props) for folder, props
+                in inventory.match_regex(snapshot, regex_list)]
 
     @requires_connection
     def get_vapps_by_regex(self, regex_list):
-        all_vapps = []
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.VirtualApp],
-            recursive=True)
-        for regex in regex_list:
-            for vapp in invtvw.view:
-                if re.match(regex, vapp.name):
-                    all_vapps.append(Vapp(self.si, vapp))
-        return all_vapps
+        snapshot = self.get_inventory(vim.VirtualApp)
+        return [Vapp(self.si, vapp, props) for vapp, props
+                in inventory.match_regex(snapshot, regex_list)]
 
     @requires_connection
     def get_datastores(self, dc_name=None, ds_type=None):
         if dc_name:
             ds_list = self.get_datacenter_by_name(dc_name).dc.datastore
         else:
-            vmgr = self.si.RetrieveContent().viewManager
-            invtvw = vmgr.CreateContainerView(
-                container=self.get_root_folder(self.si),
-                type=[vim.Datastore],
-                recursive=True)
+            invtvw = self.get_view(self.si, [vim.Datastore])
             ds_list = [ds for ds in invtvw.view]
 
         if ds_type:
@@ -358,9 +452,12 @@ class Datacenter(ManagedObject):
         return Cluster(self.si, c)
 
     def get_cluster_by_name(self, name):
-        for cluster in self.get_clusters():
-            if cluster.name() == name:
-                return cluster
+        # Names of the clusters in the host folder in one round trip
+        for cluster, props in inventory.collect_related(
+                self.si, self.dc.hostFolder, 'childEntity',
+                vim.ClusterComputeResource):
+            if props.get('name') == name:
+                return Cluster(self.si, cluster)
         print 'Cluster {} not exist on DC {}'.format(name, self.name())
         return None
 
@@ -379,11 +476,7 @@ class Datacenter(ManagedObject):
         return None
 
     def get_dvs_by_name(self, name):
-        vmgr = self.si.RetrieveContent().viewManager
-        invtvw = vmgr.CreateContainerView(
-            container=self.get_root_folder(self.si),
-            type=[vim.VmwareDistributedVirtualSwitch],
-            recursive=True)
+        invtvw = self.get_view(self.si, [vim.VmwareDistributedVirtualSwitch])
         for dvs in invtvw.view:
             if dvs.name == name:
                 return DistributedVirtualSwitch(self.si, dvs)
@@ -450,19 +543,11 @@ class Datacenter(ManagedObject):
         return vms
 
     def get_vms_by_regex(self, regex_list, status=None):
-        all_vms = []
-        vms = self.get_vms(recursive=True)
-        for regex in regex_list:
-            for vm in vms:
-                if re.match(regex, vm.name()):
-                    all_vms.append(vm)
-        if status is not None:
-            import utils
-            if status in utils.VM_STATUS:
-                for vm in all_vms:
-                    if vm.get_state() != status:
-                        all_vms.remove(vm)
-        return all_vms
+        invtvw = self.get_view(self.si, [vim.VirtualMachine],
+                               self.dc.vmFolder)
+        snapshot = inventory.collect_properties(
+            self.si, invtvw, vim.VirtualMachine, VM_PATH_SET)
+        return match_vms(self.si, snapshot, regex_list, status)
 
 
 class Cluster(ManagedObject):
@@ -476,6 +561,18 @@ class Cluster(ManagedObject):
     def name(self):
         return self.cluster.name
 
+    def config(self):
+        return self.cluster.configurationEx
+
+    def reconfigure(self, spec):
+        """Applies the set parts of a cluster config in one task.
+
+        @param spec: vim.cluster.ConfigSpecEx
+        """
+        rcfg_task = self.cluster.ReconfigureComputeResource_Task(
+            spec=spec, modify=True)
+        task.WaitForTask(task=rcfg_task, si=self.si)
+
     def get_resourcepools(self):
         root_rp = self.cluster.resourcePool
         return [ResourcePool(self.si, rp) for rp in root_rp.resourcePool]
@@ -488,15 +585,23 @@ class Cluster(ManagedObject):
         print 'ResourcePool {} no exist on cluster {}'.format(name, self.name())
         return None
 
+    def add_host_task(self, hostConnectSpec):
+        """Starts adding host to a cluster.
+
+        @param hostConnectSpec: vim.host.ConnectSpec
+        @return vim.Task
+        """
+        return self.cluster.AddHost_Task(
+            spec=hostConnectSpec,
+            asConnected=True)
+
     def add_host(self, hostConnectSpec):
         """Adds host to a cluster.
 
         @param hostConnectSpec: vim.host.ConnectSpec
         """
 
-        hosttask = self.cluster.AddHost_Task(
-            spec=hostConnectSpec,
-            asConnected=True)
+        hosttask = self.add_host_task(hostConnectSpec)
         task.WaitForTask(task=hosttask, si=self.si)
 
     def get_hosts(self):
@@ -510,19 +615,10 @@ class Cluster(ManagedObject):
         return None
 
     def get_vms_by_regex(self, regex_list, status=None):
-        all_vms = []
-        vms = self.get_vms()
-        for regex in regex_list:
-            for vm in vms:
-                if re.match(regex, vm.name):
-                    all_vms.append(VM(self.si, vm))
-        if status is not None:
-            import utils
-            if status in utils.VM_STATUS:
-                for vm in all_vms:
-                    if vm.get_state() != status:
-                        all_vms.remove(vm)
-        return all_vms
+        invtvw = self.get_view(self.si, [vim.VirtualMachine], self.cluster)
+        snapshot = inventory.collect_properties(
+            self.si, invtvw, vim.VirtualMachine, VM_PATH_SET)
+        return match_vms(self.si, snapshot, regex_list, status)
 
     def get_vms(self):
         hosts = self.get_hosts()
@@ -552,13 +648,16 @@ class Cluster(ManagedObject):
 
 class Host(ManagedObject):
 
-    def __init__(self, si, host_system):
+    def __init__(self, si, host_system, props=None):
         if not isinstance(host_system, vim.HostSystem):
             raise TypeError("Not a vim.HostSystem object")
         self.si = si
         self.host_system = host_system
+        self.props = props or {}
 
     def name(self):
+        if 'name' in self.props:
+            return self.props['name']
         return self.host_system.name
 
     def get_datastore_by_name(self, name):
@@ -579,19 +678,9 @@ class Host(ManagedObject):
         return [VM(self.si, vm) for vm in self.host_system.vm]
 
     def get_vms_by_regex(self, regex_list, status=None):
-        all_vms = []
-        vms = self.get_vms()
-        for regex in regex_list:
-            for vm in vms:
-                if re.match(regex, vm.name()):
-                    all_vms.append(vm)
-        if status is not None:
-            import utils
-            if status in utils.VM_STATUS:
-                for vm in all_vms:
-                    if vm.get_state() != status:
-                        all_vms.remove(vm)
-        return all_vms
+        snapshot = inventory.collect_object_properties(
+            self.si, self.host_system.vm, vim.VirtualMachine, VM_PATH_SET)
+        return match_vms(self.si, snapshot, regex_list, status)
 
     def config_vmotion(self, nic_num=0):
         if not self.host_system.capability.vmotionSupported:
@@ -647,7 +736,7 @@ class Host(ManagedObject):
             print("Host {} not support nfs datastore.".format(self.name()))
             return
         print 'Add NFS {}:{} to host {}.'.format(
-            ds_spec.remoteHost, ds_spec.remotePath, self.host_system.name)
+            ds_spec.remoteHost, ds_spec.remotePath, self.name())
         self.host_system.configManager.datastoreSystem\
             .CreateNasDatastore(ds_spec)
 
@@ -733,7 +822,7 @@ class Host(ManagedObject):
             main_task = self.host_system.EnterMaintenanceMode(0)
         else:
             main_task = self.host_system.ExitMaintenanceMode(0)
-        task.WaitForTask(task=main_task, si=self.si, raiseOnError=False)
+        return task.WaitForTaskError(task=main_task, si=self.si)
 
     def reboot(self):
         print 'Reboot host {}'.format(self.name())
@@ -770,11 +859,13 @@ class Host(ManagedObject):
 
 class VM(ManagedObject):
 
-    def __init__(self, si, vm):
+    def __init__(self, si, vm, props=None):
         if not isinstance(vm, vim.VirtualMachine):
             raise TypeError("Not a vim.VirtualMachine object")
         self.si = si
         self.vm = vm
+        # Properties prefetched by an inventory snapshot
+        self.props = props or {}
 
     # to retrive properties of managed object (dc, cluster, vm, ...)
     def ip(self):
@@ -823,10 +914,13 @@ class VM(ManagedObject):
         task.WaitForTask(task=reconfig_task, si=self.si)
 
     def name(self):
+        if 'name' in self.props:
+            return self.props['name']
         return self.vm.name
 
     def rename(self, new_name):
         self.vm.Rename(new_name)
+        self.props.pop('name', None)
 
     def get_state(self):
         state = self.vm.runtime.powerState
@@ -878,13 +972,34 @@ class VM(ManagedObject):
         print 'Reboot vm {}'.format(self.name())
         self.vm.RebootGuest()
 
+    def poweroff_task(self):
+        """Starts powering off the vm, None if the prefetched or current
+        power state is already off.
+
+        @return vim.Task or None
+        """
+        from utils import VM_STATUS
+        state = self.props.get('runtime.powerState') or self.get_state()
+        if state == VM_STATUS[1]:
+            return None
+        print 'Power off vm {}'.format(self.name())
+        return self.vm.PowerOff()
+
+    def destroy_task(self):
+        """Starts destroying the vm, which must not be powered on.
+
+        @return vim.Task
+        """
+        print 'Destroy vm {}'.format(self.name())
+        return self.vm.Destroy()
+
     def destroy(self):
         from utils import VM_STATUS
         if self.get_state() == VM_STATUS[0]:
             self.poweroff()
         print 'Destroy vm {}'.format(self.name())
         destroy_task = self.vm.Destroy()
-        task.WaitForTask(task=destroy_task, si=self.si, raiseOnError=False)
+        return task.WaitForTaskError(task=destroy_task, si=self.si)
 
     def unregister(self):
         from utils import VM_STATUS
@@ -902,18 +1017,23 @@ class VM(ManagedObject):
                                       customization=None)
         print 'Clone vm {} from {}'.format(name, self.name())
         clone_task = self.vm.Clone(self.vm.parent, name, clone_spec)
-        task.WaitForTask(task=clone_task, si=self.si, raiseOnError=False)
+        return task.WaitForTaskError(task=clone_task, si=self.si)
 
     def snapshot(self, snap_name):
         print 'Take snapshot {} on {}'.format(snap_name, self.name())
         snapshot_task = self.vm.CreateSnapshot(snap_name, snap_name, True, True)
-        task.WaitForTask(task=snapshot_task, si=self.si, raiseOnError=False)
+        return task.WaitForTaskError(task=snapshot_task, si=self.si)
 
     def remove_snapshots(self):
         print 'Remove all snapshots on {}'.format(self.name())
         self.vm.RemoveAllSnapshots()
 
     def migrate(self, dest_host, dest_datastore):
+        vmotion_task = self.migrate_task(dest_host, dest_datastore)
+        return task.WaitForTaskError(task=vmotion_task, si=self.si)
+
+    def migrate_task(self, dest_host, dest_datastore):
+        """Starts the migration and returns its task without waiting."""
         # Support change both host and datastore
         vm_relocate_spec = vim.vm.RelocateSpec()
         vm_relocate_spec.host = dest_host.host_system
@@ -923,8 +1043,7 @@ class VM(ManagedObject):
             .format(self.vm.name,
                     dest_datastore.ds.name,
                     dest_host.host_system.name)
-        vmotion_task = self.vm.Relocate(spec=vm_relocate_spec)
-        task.WaitForTask(task=vmotion_task, si=self.si, raiseOnError=False)
+        return self.vm.Relocate(spec=vm_relocate_spec)
 
     def get_datastores(self):
         self.vm.RefreshStorageInfo()
@@ -1020,13 +1139,40 @@ class DistributedVirtualSwitch(ManagedObject):
     def config(self):
         return self.dvs.config
 
+    def get_host_members(self):
+        """Returns the member hosts and the config version in one fetch.
+
+        @return (set of vim.HostSystem, configVersion) tuple
+        """
+        props = inventory.collect_object_properties(
+            self.si, [self.dvs], vim.DistributedVirtualSwitch,
+            ['config.host', 'config.configVersion'])[0][1]
+        members = set(member.config.host
+                      for member in props.get('config.host') or [])
+        return members, props.get('config.configVersion')
+
+    def get_portgroups(self):
+        """Returns the portgroups of this DVS in one round trip.
+
+        @return dict name -> (vim.dvs.DistributedVirtualPortgroup,
+        property dict with 'name' and 'key')
+        """
+        return dict((props.get('name'), (pg, props))
+                    for pg, props in inventory.collect_related(
+                        self.si, self.dvs, 'portgroup',
+                        vim.dvs.DistributedVirtualPortgroup, ['name', 'key']))
+
     def get_portgroup(self, pg_name):
-        return self.get_obj(self.si, [vim.dvs.DistributedVirtualPortgroup], pg_name)
+        pg = self.get_portgroups().get(pg_name)
+        return pg[0] if pg else None
 
     def add_portgroup(self, spec):
-        pg_task = self.dvs.AddDVPortgroup_Task([spec])
-        task.WaitForTask(task=pg_task, si=self.si)
-        return pg_task.info.result
+        return self.add_portgroups([spec])
+
+    def add_portgroups(self, specs):
+        """Creates all the portgroups with one AddDVPortgroup_Task."""
+        pg_task = self.dvs.AddDVPortgroup_Task(specs)
+        return task.WaitForTaskResult(task=pg_task, si=self.si)
 
     def reconfig_dvs(self, spec):
         dvs_config_task = self.dvs.ReconfigureDvs_Task(spec)
@@ -1039,35 +1185,45 @@ class DistributedVirtualSwitch(ManagedObject):
 
 
 class Network(ManagedObject):
-    def __init__(self, si, net):
+    def __init__(self, si, net, props=None):
         if not isinstance(net, vim.Network):
             raise TypeError("Not a vim.Network object")
         self.si = si
         self.net = net
+        self.props = props or {}
 
     def name(self):
+        if 'name' in self.props:
+            return self.props['name']
         return self.net.name
 
-    def destroy(self):
-        destroy_task = self.net.Destroy()
+    def destroy_task(self):
         print 'Delete network {}'.format(self.name())
-        task.WaitForTask(task=destroy_task, si=self.si)
+        return self.net.Destroy()
+
+    def destroy(self):
+        task.WaitForTask(task=self.destroy_task(), si=self.si)
 
 
 class Folder(ManagedObject):
-    def __init__(self, si, folder):
+    def __init__(self, si, folder, props=None):
         if not isinstance(folder, vim.Folder):
             raise TypeError("Not a vim.Folder object")
         self.si = si
         self.folder = folder
+        self.props = props or {}
 
     def name(self):
+        if 'name' in self.props:
+            return self.props['name']
         return self.folder.name
 
-    def destroy(self):
-        destroy_task = self.folder.Destroy()
+    def destroy_task(self):
         print 'Delete folder {}'.format(self.name())
-        task.WaitForTask(task=destroy_task, si=self.si)
+        return self.folder.Destroy()
+
+    def destroy(self):
+        task.WaitForTask(task=self.destroy_task(), si=self.si)
 
     def get_vms(self, recursive=False):
         child_entitys = self.folder.childEntity
@@ -1109,43 +1265,39 @@ class ResourcePool(ManagedObject):
         return [VM(self.si, vm) for vm in self.rp.vm]
 
     def get_vms_by_regex(self, regex_list, status=None):
-        all_vms = []
-        vms = self.get_vms()
-        for regex in regex_list:
-            for vm in vms:
-                if re.match(regex, vm.name()):
-                    all_vms.append(vm)
-        if status is not None:
-            import utils
-            if status in utils.VM_STATUS:
-                for vm in all_vms:
-                    if vm.get_state() != status:
-                        all_vms.remove(vm)
-        return all_vms
+        snapshot = inventory.collect_object_properties(
+            self.si, self.rp.vm, vim.VirtualMachine, VM_PATH_SET)
+        return match_vms(self.si, snapshot, regex_list, status)
 
 
 class Vapp(ManagedObject):
-    def __init__(self, si, vapp):
+    def __init__(self, si, vapp, props=None):
         if not isinstance(vapp, vim.VirtualApp):
             raise TypeError("Not a vim.VirtualApp object")
         self.si = si
         self.vapp = vapp
+        self.props = props or {}
 
     def name(self):
+        if 'name' in self.props:
+            return self.props['name']
         return self.vapp.name
 
     def rename(self, new_name):
         self.vapp.Rename(new_name)
+        self.props.pop('name', None)
 
     def poweroff(self):
         print 'Power off vApp {}'.format(self.name())
         poweroff_task = self.vapp.PowerOff(force=True)
         task.WaitForTask(task=poweroff_task, si=self.si)
 
-    def destroy(self):
+    def destroy_task(self):
         print 'Destroy vApp {}'.format(self.name())
-        destroy_task = self.vapp.Destroy()
-        task.WaitForTask(task=destroy_task, si=self.si)
+        return self.vapp.Destroy()
+
+    def destroy(self):
+        task.WaitForTask(task=self.destroy_task(), si=self.si)
 
     def get_state(self):
         state = self.vapp.summary.vAppState
@@ -0,0 +1,114 @@
+"""Fakes of the vCenter objects shared by the tests"""
+
+import threading
+import time
+from pyVmomi import vim
+
+
+class Struct(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def get_update(version, *obj_updates):
+    return Struct(version=version, truncated=False,
+                  filterSet=[Struct(objectSet=list(obj_updates))])
+
+
+def modify(obj, *changes):
+    """Returns the update of the (name, value) properties of obj."""
+    return Struct(obj=obj, kind='modify',
+                  changeSet=[Struct(name=name, op='assign', val=val)
+                             for name, val in changes])
+
+
+def enter(obj, name):
+    update = modify(obj, ('name', name))
+    update.kind = 'enter'
+    return update
+
+
+def leave(obj):
+    return Struct(obj=obj, kind='leave', changeSet=[])
+
+
+class FakeStub(object):
+    """Answers the calls made on real managed objects, e.g. DestroyView,
+    and records the ModifyListView calls
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+
+    def InvokeMethod(self, mo, info, args):
+        if info.wsdlName != 'ModifyListView':
+            return None
+        add, remove = args
+        self.added.extend(add or [])
+        self.removed.extend(remove or [])
+
+
+class FakePropertyCollector(object):
+    """Answers WaitForUpdatesEx from a script of updates and faults"""
+
+    def __init__(self, script=(), delay=0):
+        """
+        @param delay: seconds CreatePropertyCollector takes, so that
+        concurrent first uses overlap
+        """
+        self.script = list(script)
+        self.delay = delay
+        self.versions = []
+        self.collectors = []
+        self.cond = threading.Condition()
+
+    def CreatePropertyCollector(self):
+        time.sleep(self.delay)
+        self.collectors.append(self)
+        return self
+
+    def CreateFilter(self, spec, partialUpdates):
+        return Struct(Destroy=lambda: None)
+
+    def WaitForUpdatesEx(self, version, options):
+        with self.cond:
+            self.versions.append(version)
+            if not self.script:
+                self.cond.wait(0.01)
+                return None
+            result = self.script.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def Push(self, result):
+        with self.cond:
+            self.script.append(result)
+            self.cond.notify_all()
+
+    def CancelWaitForUpdates(self):
+        pass
+
+    def DestroyPropertyCollector(self):
+        pass
+
+
+class FakeServiceInstance(object):
+
+    def __init__(self, updates=(), delay=0):
+        self._stub = object()
+        self.pc = FakePropertyCollector(updates, delay)
+        self.view_stub = FakeStub()
+        self.view = vim.view.ListView('session[1]', self.view_stub)
+        self.content = Struct(
+            rootFolder=vim.Folder('group-d1'),
+            propertyCollector=self.pc,
+            viewManager=Struct(
+                CreateListView=lambda: self.view,
+                CreateContainerView=lambda **kwargs: vim.view.ContainerView(
+                    'session[2]', self.view_stub)))
+
+    def RetrieveContent(self):
+        return self.content
@@ -0,0 +1,106 @@
+import threading
+import time
+import unittest
+from pyVmomi import vim
+from common import bulk
+from common import task
+from tests.fakes import FakeServiceInstance
+
+
+class Item(object):
+
+    def __init__(self, name, state='success', error=None):
+        self.item_name = name
+        self.task_state = state
+        self.error = error
+
+    def name(self):
+        return self.item_name
+
+
+class FakeWatcher(object):
+    """Finishes every watched task from another thread"""
+
+    def __init__(self):
+        self.watched = []
+
+    def Watch(self, item):
+        self.watched.append(item)
+        future = task.TaskFuture(item)
+        threading.Timer(0.01, future.Finish,
+                        args=(item.task_state, item.error)).start()
+        return future
+
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.si = FakeServiceInstance()
+        self.watcher = FakeWatcher()
+        task._taskWatchers[self.si._stub] = self.watcher
+        self.addCleanup(task._taskWatchers.pop, self.si._stub)
+
+    def submit(self, item):
+        if item.task_state is None:
+            return None
+        if item.task_state == 'raise':
+            raise ValueError('submit failed')
+        return item
+
+    def test_run_tasks(self):
+        items = [Item('ok'), Item('failed', 'error', 'fault'),
+                 Item('noop', None), Item('raised', 'raise')]
+        results = bulk.run_tasks(self.si, items, self.submit, limit=2)
+        self.assertEqual([result.item for result in results], items)
+        self.assertEqual([result.state for result in results],
+                         ['success', 'error', 'success', 'error'])
+        self.assertEqual(results[1].error, 'fault')
+        self.assertIsInstance(results[3].error, ValueError)
+        self.assertFalse(results[3].ok())
+        self.assertEqual(self.watcher.watched, items[:2])
+
+    def test_does_not_wait_for_idle_workers(self):
+        start = time.time()
+        bulk.run_tasks(self.si, [Item('ok')], self.submit)
+        bulk.run_task_graph(self.si, [Item('ok')], {}, self.submit)
+        bulk.run_calls([Item('ok')], lambda item: None)
+        self.assertLess(time.time() - start, 2)
+
+    def test_run_task_graph_skips_dependents(self):
+        vm_ok = Item('vm-ok')
+        vm_failed = Item('vm-failed', 'raise')
+        net = Item('net')
+        folder = Item('folder')
+        other = Item('other')
+        deps = {net: [vm_ok, vm_failed], folder: [net], other: [vm_ok]}
+        done = []
+        results = bulk.run_task_graph(
+            self.si, [vm_ok, vm_failed, net, folder, other], deps,
+            self.submit, on_done=lambda result: done.append(result.item))
+        states = dict((result.item.name(), result.state)
+                      for result in results)
+        self.assertEqual(states, {'vm-ok': 'success', 'vm-failed': 'error',
+                                  'net': bulk.SKIPPED,
+                                  'folder': bulk.SKIPPED,
+                                  'other': 'success'})
+        self.assertEqual(results[3].error, 'depends on net')
+        self.assertEqual(sorted(item.name() for item in done),
+                         sorted(states))
+        # Dependents start only after what they depend on
+        self.assertLess(done.index(vm_ok), done.index(other))
+        self.assertNotIn(net, self.watcher.watched)
+
+    def test_run_calls(self):
+        def func(item):
+            if item.task_state == 'raise':
+                raise ValueError('call failed')
+        results = bulk.run_calls([Item('ok'), Item('raised', 'raise')], func)
+        self.assertEqual([result.state for result in results],
+                         [vim.TaskInfo.State.success,
+                          vim.TaskInfo.State.error])
+        self.assertIsInstance(results[1].error, ValueError)
+        self.assertIsNotNone(results[0].elapsed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from pyVmomi import vim
+from common import cleanup
+
+
+class FakeVirtualCenter(object):
+
+    def __init__(self, snapshot):
+        self.si = None
+        self.snapshot = snapshot
+
+    def get_inventory_snapshot(self, path_sets):
+        return self.snapshot
+
+
+class CleanupGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = []
+
+    def add(self, obj, name, **props):
+        props['name'] = name
+        self.snapshot.append((obj, props))
+        return obj
+
+    def get_graph(self):
+        return cleanup.CleanupGraph(FakeVirtualCenter(self.snapshot),
+                                    ['vm-.*'], ['net-.*'], ['folder-.*'])
+
+    def names(self, objs):
+        return sorted(obj.name() for obj in objs)
+
+    def test_networks(self):
+        vm_1 = self.add(vim.VirtualMachine('vm-1'), 'vm-1')
+        keep = self.add(vim.VirtualMachine('vm-2'), 'keep')
+        self.add(vim.Network('network-1'), 'net-a', vm=[vm_1])
+        self.add(vim.Network('network-2'), 'net-b', vm=[vm_1, keep])
+        graph = self.get_graph()
+        items, deps = graph.get_deps(graph.vms)
+        self.assertEqual(self.names(items), ['net-a'])
+        self.assertEqual(self.names(deps[items[0]]), ['vm-1'])
+        self.assertEqual([(obj.name(), reason) for obj, reason
+                          in graph.in_use], [('net-b', 'used by vm keep')])
+
+    def test_nested_folder_goes_with_parent(self):
+        vm_1 = self.add(vim.VirtualMachine('vm-1'), 'vm-1')
+        inner = self.add(vim.Folder('group-2'), 'folder-b',
+                         childEntity=[vm_1])
+        self.add(vim.Folder('group-1'), 'folder-a', childEntity=[inner])
+        graph = self.get_graph()
+        items, deps = graph.get_deps(graph.vms)
+        self.assertEqual(self.names(items), ['folder-a'])
+        self.assertEqual(self.names(deps[items[0]]), ['vm-1'])
+        self.assertEqual(graph.in_use, [])
+
+    def test_nested_folder_of_skipped_parent(self):
+        vm_1 = self.add(vim.VirtualMachine('vm-1'), 'vm-1')
+        keep = self.add(vim.VirtualMachine('vm-2'), 'keep')
+        deep = self.add(vim.Folder('group-4'), 'folder-d',
+                        childEntity=[])
+        inner = self.add(vim.Folder('group-2'), 'folder-b',
+                         childEntity=[vm_1, deep])
+        self.add(vim.Folder('group-1'), 'folder-a',
+                 childEntity=[inner, keep])
+        graph = self.get_graph()
+        items, deps = graph.get_deps(graph.vms)
+        # folder-a is kept, its top-most destroyable descendant goes
+        self.assertEqual(self.names(items), ['folder-b'])
+        self.assertEqual(self.names(deps[items[0]]), ['vm-1'])
+        self.assertEqual([(obj.name(), reason) for obj, reason
+                          in graph.in_use], [('folder-a', 'holds keep')])
+
+    def test_folder_of_vm_left_powered_on(self):
+        vm_1 = self.add(vim.VirtualMachine('vm-1'), 'vm-1')
+        self.add(vim.Folder('group-1'), 'folder-a', childEntity=[vm_1])
+        graph = self.get_graph()
+        items, deps = graph.get_deps([])
+        self.assertEqual(items, [])
+        self.assertEqual([(obj.name(), reason) for obj, reason
+                          in graph.in_use], [('folder-a', 'holds vm-1')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import threading
+import time
+import unittest
+from common import dag
+
+
+class DagExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = dag.DagExecutor(concurrency=3)
+        self.ran = []
+        self.lock = threading.Lock()
+
+    def step(self, name, fail=False):
+        with self.lock:
+            self.ran.append(name)
+        if fail:
+            raise ValueError(name)
+        return name
+
+    def add(self, name, deps=(), fail=False):
+        self.executor.add(name, self.step, deps, args=(name, fail))
+
+    def test_runs_after_dependencies(self):
+        self.add('vc')
+        self.add('dc', ['vc'])
+        self.add('cluster', ['dc'])
+        self.add('host', ['cluster', 'dc'])
+        nodes = self.executor.run()
+        self.assertEqual(self.ran, ['vc', 'dc', 'cluster', 'host'])
+        self.assertEqual(nodes['host'].state, dag.DONE)
+        self.assertEqual(self.executor.result('cluster'), 'cluster')
+        self.assertEqual(self.executor.failed(), [])
+
+    def test_does_not_wait_for_idle_workers(self):
+        self.add('vc')
+        start = time.time()
+        self.executor.run()
+        self.assertLess(time.time() - start, 2)
+
+    def test_failure_skips_dependents(self):
+        self.add('vc')
+        self.add('dc', ['vc'], fail=True)
+        self.add('cluster', ['dc'])
+        self.add('host', ['cluster'])
+        self.add('network', ['vc'])
+        self.add('vm', ['network', 'host'])
+        nodes = self.executor.run()
+        self.assertEqual(nodes['dc'].state, dag.FAILED)
+        self.assertIsInstance(nodes['dc'].error, ValueError)
+        for name in ('cluster', 'host', 'vm'):
+            self.assertEqual(nodes[name].state, dag.SKIPPED)
+        self.assertEqual(nodes['network'].state, dag.DONE)
+        self.assertEqual(sorted(self.ran), ['dc', 'network', 'vc'])
+        self.assertEqual(self.executor.failed(),
+                         ['dc', 'cluster', 'host', 'vm'])
+
+    def test_rejects_bad_graphs(self):
+        self.add('dc', ['vc'])
+        self.assertRaises(ValueError, self.executor.run)
+        self.add('vc', ['cluster'])
+        self.add('cluster', ['dc'])
+        self.assertRaises(ValueError, self.executor.run)
+        self.assertRaises(ValueError, self.add, 'vc')
+        self.assertEqual(self.ran, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import threading
+import unittest
+from pyVmomi import vim
+from common import inventory
+from common import vmwareapi
+from tests.fakes import FakeServiceInstance, enter, get_update, leave, modify
+
+
+class InventoryIndexTest(unittest.TestCase):
+
+    def get_index(self, updates):
+        si = FakeServiceInstance(updates)
+        view = inventory.get_view_manager(si).get_view([vim.HostSystem])
+        self.addCleanup(inventory.release_views, si)
+        index = inventory.InventoryIndex(si, view, [vim.HostSystem,
+                                                    vim.Network])
+        return si, index
+
+    def test_lookup_follows_updates(self):
+        host_1 = vim.HostSystem('host-1')
+        host_2 = vim.HostSystem('host-2')
+        si, index = self.get_index([get_update('1', enter(host_1, 'esx-1'),
+                                               enter(host_2, 'esx-2'))])
+        self.assertEqual(index.lookup([vim.HostSystem], 'esx-1'), [host_1])
+        self.assertEqual(index.lookup([vim.Network], 'esx-1'), [])
+        # Misses poll for updates
+        si.pc.Push(get_update('2', modify(host_1, ('name', 'esx-3')),
+                              leave(host_2)))
+        self.assertEqual(index.lookup([vim.HostSystem], 'esx-3'), [host_1])
+        self.assertEqual(index.lookup([vim.HostSystem], 'esx-1'), [])
+        self.assertEqual(index.lookup([vim.HostSystem], 'esx-2'), [])
+
+    def test_covers(self):
+        si, index = self.get_index([])
+        self.assertTrue(index.covers([vim.HostSystem]))
+        self.assertTrue(index.covers([vim.dvs.DistributedVirtualPortgroup]))
+        self.assertFalse(index.covers([vim.HostSystem, vim.Datastore]))
+
+
+class RegexTest(unittest.TestCase):
+
+    def names(self, regex_list, names):
+        snapshot = [(vim.VirtualMachine('vm-%d' % i), {'name': name})
+                    for i, name in enumerate(names)]
+        return [props['name'] for obj, props
+                in inventory.match_regex(snapshot, regex_list)]
+
+    def test_alternation(self):
+        self.assertEqual(self.names(['web-\\d+', 'db'],
+                                    ['web-1', 'db-2', 'app', 'x-web-3']),
+                         ['web-1', 'db-2'])
+
+    def test_backreferences(self):
+        # Joined, the second backreference would refer to the first group
+        self.assertEqual(self.names(['(a)\\1', '(b)\\1'],
+                                    ['aa', 'bb', 'ba']),
+                         ['aa', 'bb'])
+
+    def test_named_groups(self):
+        self.assertEqual(self.names(['(?P<n>a)x', '(?P<n>b)y'],
+                                    ['ax', 'by', 'bx']),
+                         ['ax', 'by'])
+
+    def test_inline_flags(self):
+        self.assertEqual(self.names(['(?i)web', 'DB'], ['WEB', 'db', 'DB']),
+                         ['WEB', 'DB'])
+
+    def test_duplicates(self):
+        vm = vim.VirtualMachine('vm-1')
+        snapshot = [(vm, {'name': 'web'}), (vm, {'name': 'web'})]
+        self.assertEqual(len(inventory.match_regex(snapshot, ['web'])), 1)
+
+    def test_collect_object_properties_dedupes(self):
+        retrieved = []
+        real_retrieve = inventory.retrieve
+        inventory.retrieve = lambda si, spec: retrieved.append(spec) or []
+        self.addCleanup(setattr, inventory, 'retrieve', real_retrieve)
+        hosts = [vim.HostSystem('host-%d' % (i % 3)) for i in range(9)]
+        inventory.collect_object_properties(None, hosts, vim.HostSystem)
+        self.assertEqual([spec.obj for spec in retrieved[0].objectSet],
+                         hosts[:3])
+
+
+class VirtualCenterIndexTest(unittest.TestCase):
+
+    def test_concurrent_first_use_builds_one_index(self):
+        vc = vmwareapi.VirtualCenter('vc', 'admin', 'pwd', use_index=True)
+        vc.si = FakeServiceInstance(delay=0.05)
+        self.addCleanup(inventory.release_views, vc.si)
+        self.addCleanup(inventory.unregister_index, vc.si)
+        indexes = []
+        threads = [threading.Thread(
+            target=lambda: indexes.append(vc.get_index()))
+            for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(vc.si.pc.collectors), 1)
+        self.assertEqual(len(set(indexes)), 1)
+        self.assertIs(inventory.get_index(vc.si), indexes[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
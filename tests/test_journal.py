@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+from common import dag
+from common import journal
+from common import utils
+
+
+class DigestTest(unittest.TestCase):
+
+    def test_inputs(self):
+        inputs = [('name', 'dc'), ('parent', 'vc_0')]
+        self.assertEqual(journal.digest(inputs),
+                         journal.digest(list(reversed(inputs))))
+        self.assertNotEqual(journal.digest(inputs),
+                            journal.digest([('name', 'dc2'),
+                                            ('parent', 'vc_0')]))
+
+    def test_dep_digests(self):
+        inputs = [('name', 'cluster')]
+        vc = journal.digest([('ip', 'vc')])
+        dc = journal.digest([('name', 'dc')])
+        self.assertEqual(journal.digest(inputs, [vc, dc]),
+                         journal.digest(inputs, [dc, vc]))
+        self.assertNotEqual(journal.digest(inputs, [vc]),
+                            journal.digest(inputs, [dc]))
+        self.assertNotEqual(journal.digest(inputs),
+                            journal.digest(inputs, [vc]))
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        real_dir = utils.JOURNAL_DIR
+        utils.JOURNAL_DIR = os.path.join(self.dir, 'journal')
+        self.addCleanup(setattr, utils, 'JOURNAL_DIR', real_dir)
+        self.path = journal.get_journal_path('config.ini', 'vc_0')
+
+    def test_round_trip(self):
+        self.assertNotEqual(self.path,
+                            journal.get_journal_path('config.ini', 'vc_1'))
+        steps = journal.Journal(self.path)
+        self.assertFalse(steps.done('dc_0', 'abc'))
+        steps.record('dc_0', 'abc')
+        steps = journal.Journal(self.path)
+        self.assertTrue(steps.done('dc_0', 'abc'))
+        self.assertFalse(steps.done('dc_0', 'def'))
+        self.assertFalse(steps.done('dc_0', None))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_corrupt_journal_is_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as journal_file:
+            journal_file.write('{')
+        self.assertEqual(journal.Journal(self.path).steps, {})
+
+    def run_steps(self, dc_name, resume=True):
+        ran = []
+        executor = dag.DagExecutor(journal=journal.Journal(self.path),
+                                   resume=resume)
+        executor.add('vc_0', ran.append, args=('vc_0',),
+                     inputs=[('ip', 'vc')])
+        executor.add('dc_0', ran.append, ['vc_0'], args=('dc_0',),
+                     inputs=[('name', dc_name)])
+        executor.add('cluster_0', ran.append, ['dc_0'], args=('cluster_0',),
+                     inputs=[('name', 'cluster')])
+        executor.add('report', ran.append, ['cluster_0'], args=('report',))
+        executor.run()
+        return ran
+
+    def test_resume_skips_unchanged_steps(self):
+        self.assertEqual(self.run_steps('dc'),
+                         ['vc_0', 'dc_0', 'cluster_0', 'report'])
+        self.assertEqual(self.run_steps('dc'), ['report'])
+        # Editing a section runs it and everything depending on it again
+        self.assertEqual(self.run_steps('dc2'),
+                         ['dc_0', 'cluster_0', 'report'])
+        self.assertEqual(self.run_steps('dc2', resume=False),
+                         ['vc_0', 'dc_0', 'cluster_0', 'report'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from common import limiter
+
+
+class Fault(Exception):
+
+    def __init__(self, wsdl_name):
+        Exception.__init__(self, wsdl_name)
+        self._wsdlName = wsdl_name
+
+
+def run_window(slots, latency=1.0, error=None, queued=False, count=None):
+    """Completes one window of operations at the current limit."""
+    for i in range(count or slots.limit):
+        slots.acquire()
+        slots.release(latency, error, queued)
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def test_grows_while_healthy(self):
+        slots = limiter.get_limiter(2, 5)
+        for i in range(5):
+            run_window(slots)
+        self.assertEqual(slots.limit, 5)
+        self.assertEqual(slots.stats()['increases'], 3)
+
+    def test_fixed_limit(self):
+        slots = limiter.get_limiter(3)
+        self.assertFalse(slots.adaptive())
+        run_window(slots, error=Fault('TooManyTickets'))
+        run_window(slots)
+        self.assertEqual(slots.limit, 3)
+
+    def test_throttle_halves_once_per_window(self):
+        slots = limiter.get_limiter(8, 16)
+        run_window(slots, error=Fault('TooManyTickets'), count=3)
+        self.assertEqual(slots.limit, 4)
+        self.assertEqual(slots.stats()['throttled'], 3)
+        self.assertEqual(slots.stats()['decreases'], 1)
+
+    def test_queued_task_decreases(self):
+        slots = limiter.get_limiter(8, 16)
+        run_window(slots, queued=True, count=1)
+        self.assertEqual(slots.limit, 4)
+
+    def test_cancel_is_not_throttling(self):
+        self.assertFalse(limiter.is_throttled(Fault('RequestCanceled')))
+        self.assertTrue(limiter.is_throttled(
+            Fault('TooManyConcurrentNativeClones')))
+
+    def test_fault_rate(self):
+        slots = limiter.get_limiter(4, 16)
+        slots.acquire()
+        slots.release(1.0, Fault('InvalidState'))
+        run_window(slots, count=3)
+        self.assertEqual(slots.limit, 2)
+
+    def test_latency(self):
+        slots = limiter.get_limiter(4, 16)
+        run_window(slots, latency=1.0)
+        self.assertEqual(slots.limit, 5)
+        run_window(slots, latency=4.0)
+        self.assertEqual(slots.limit, 2)
+
+    def test_untimed_operations_keep_latency(self):
+        slots = limiter.get_limiter(2, 16)
+        run_window(slots, latency=None)
+        run_window(slots, latency=1.0)
+        run_window(slots, latency=2.0)
+        self.assertEqual(slots.limit, 5)
+
+    def test_floor(self):
+        slots = limiter.AdaptiveLimiter(2, floor=2, ceiling=4)
+        run_window(slots, error=Fault('TooManyTickets'))
+        self.assertEqual(slots.limit, 2)
+
+    def test_wrap(self):
+        slots = limiter.get_limiter(4, 16)
+
+        def action(result):
+            if isinstance(result, ValueError):
+                raise result
+            return result
+        limited = slots.wrap(action, lambda result: result
+                             if isinstance(result, Exception) else None)
+        self.assertEqual(limited('done'), 'done')
+        self.assertRaises(ValueError, limited, ValueError('failed'))
+        fault = Fault('TooManyTickets')
+        self.assertIs(limited(fault), fault)
+        stats = slots.stats()
+        self.assertEqual(stats['completed'], 3)
+        self.assertEqual(stats['faults'], 2)
+        self.assertEqual(stats['throttled'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(slots.limit, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
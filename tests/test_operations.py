@@ -0,0 +1,89 @@
+import StringIO
+import sys
+import unittest
+from pyVmomi import vim
+from common import bulk
+from common import operations
+
+
+class FakeVirtualCenter(object):
+
+    def __init__(self, host_names):
+        self.si = None
+        self.host_names = host_names
+        self.retrievals = 0
+
+    def get_host_names(self):
+        self.retrievals += 1
+        return [(vim.HostSystem('host-{}'.format(i)), name)
+                for i, name in enumerate(self.host_names)]
+
+    def get_hosts_by_names(self, names):
+        raise AssertionError('hosts resolved again')
+
+
+class ConfigHostsTest(unittest.TestCase):
+
+    def test_uses_one_snapshot(self):
+        vc = FakeVirtualCenter(['esx-1', 'esx-2'])
+        self.assertEqual(operations.config_hosts(vc, '', fw_rule=''), [])
+        self.assertEqual(vc.retrievals, 1)
+
+    def test_no_hosts(self):
+        vc = FakeVirtualCenter([])
+        self.assertEqual(operations.config_hosts(vc, 'ssh', fw_rule=''), [])
+
+    def test_settings_select_hosts(self):
+        hosts = operations.get_all_hosts(FakeVirtualCenter(['esx-1',
+                                                            'esx-2']))
+        configured = []
+        for host in hosts:
+            host.enable_ssh = lambda host=host: configured.append(
+                host.name())
+        settings = {'esx-2': operations.get_host_settings(
+            services=['ssh'])}
+        self.assertEqual(operations.config_host_settings(hosts, settings),
+                         [])
+        self.assertEqual(configured, ['esx-2'])
+
+
+class FakeCluster(object):
+
+    si = None
+
+    def name(self):
+        return 'cluster'
+
+
+class AddHostsTest(unittest.TestCase):
+
+    def patch(self, obj, name, value):
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)
+
+    def run_tasks(self, si, items, submit, limit):
+        results = []
+        for item in items:
+            result = bulk.BulkResult(item)
+            result.state = 'error' if item == 'esx-2' else 'success'
+            result.error = 'unreachable' if item == 'esx-2' else None
+            results.append(result)
+        return results
+
+    def test_counts_duplicates_once(self):
+        self.patch(operations.thumbprint, 'get_thumbprints',
+                   lambda names, refresh=False: {})
+        self.patch(operations.bulk, 'run_tasks', self.run_tasks)
+        self.patch(sys, 'stdout', StringIO.StringIO())
+        report = operations.add_hosts_to_cluster(
+            FakeVirtualCenter(['esx-1']), FakeCluster(), 'root', 'pwd',
+            'esx-1,esx-2,esx-3,esx-2')
+        output = sys.stdout.getvalue()
+        self.assertEqual(report, {'esx-1': None, 'esx-2': 'unreachable',
+                                  'esx-3': None})
+        self.assertEqual(output.count('Failed to add host esx-2'), 1)
+        self.assertIn('1 hosts added, 1 failed', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import ConfigParser
+import StringIO
+import unittest
+from pyVmomi import vim
+from common import plan
+from tests.fakes import Struct
+
+CONFIG = """
+[info_vc]
+vc_user=admin
+vc_pwd=pwd
+license=
+
+[info_host]
+user=root
+pwd=pwd
+ntp=ntp-1,ntp-2
+services=ssh
+firewall=sshServer
+license=
+
+[vc_0]
+ip=vc
+
+[dc_0]
+parent=vc_0
+name=dc
+
+[cluster_0]
+parent=dc_0
+name=cluster
+services=drs
+host_add_list=esx-1,esx-3
+"""
+
+
+class FakeVirtualCenter(object):
+
+    host = 'vc'
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        license_manager = Struct(licenseAssignmentManager=Struct(
+            QueryAssignedLicenses=lambda: []))
+        content = Struct(about=Struct(instanceUuid='uuid'),
+                         licenseManager=license_manager)
+        self.si = Struct(RetrieveContent=lambda: content)
+
+    def get_inventory_snapshot(self, path_sets):
+        return self.snapshot
+
+
+def get_host_props(name, parent, ntp, running, rules):
+    return {
+        'name': name, 'parent': parent, 'datastore': [],
+        'config.dateTimeInfo': Struct(ntpConfig=Struct(server=ntp)),
+        'config.service': Struct(service=[
+            Struct(key=key, running=True) for key in running]),
+        'config.firewall': Struct(ruleset=[
+            Struct(key=key, enabled=True) for key in rules]),
+        'config.vmotion': None,
+    }
+
+
+class PlanTest(unittest.TestCase):
+
+    def get_plan(self, snapshot, **options):
+        cf = ConfigParser.ConfigParser()
+        cf.readfp(StringIO.StringIO(CONFIG))
+        for key, value in options.items():
+            section, option = key.split('__')
+            if not cf.has_section(section):
+                cf.add_section(section)
+            cf.set(section, option, value)
+        return plan.plan_vc(cf, 'vc_0', FakeVirtualCenter(snapshot))
+
+    def get_snapshot(self, esx_1_ntp):
+        dc = vim.Datacenter('datacenter-1')
+        folder = vim.Folder('group-h1')
+        cluster = vim.ClusterComputeResource('domain-c1')
+        drs = Struct(drsConfig=Struct(enabled=True), dasConfig=None)
+        return [
+            (dc, {'name': 'dc', 'parent': None}),
+            (folder, {'name': 'host', 'parent': dc}),
+            (cluster, {'name': 'cluster', 'parent': folder,
+                       'configurationEx': drs}),
+            (vim.HostSystem('host-1'), get_host_props(
+                'esx-1', cluster, esx_1_ntp, ['ntpd', 'TSM-SSH'],
+                ['sshServer'])),
+            (vim.HostSystem('host-2'), get_host_props(
+                'esx-2', folder, [], [], [])),
+        ]
+
+    def test_ntp_order_does_not_matter(self):
+        vc_plan = self.get_plan(self.get_snapshot(['ntp-2', 'ntp-1']))
+        self.assertEqual(vc_plan.targets('hosts_vc_0', plan.HOST_NTP),
+                         ['esx-2', 'esx-3'])
+
+    def test_configured_site_has_no_changes(self):
+        snapshot = self.get_snapshot(['ntp-2', 'ntp-1'])[:-1]
+        vc_plan = self.get_plan(snapshot, cluster_0__host_add_list='',
+                                nfs_0__parent='vc_0',
+                                nfs_0__target_hosts='',
+                                nfs_0__local_name='nfs')
+        self.assertEqual(vc_plan.changes, [])
+
+    def test_changes(self):
+        vc_plan = self.get_plan(self.get_snapshot(['ntp-1']))
+        self.assertFalse(vc_plan.changed('dc_0'))
+        self.assertEqual(vc_plan.targets('cluster_0', plan.HOST), ['esx-3'])
+        self.assertEqual(vc_plan.get('cluster_0', plan.CLUSTER_SERVICE), [])
+        # Every host of the vCenter is planned, not only the cluster hosts
+        self.assertEqual(vc_plan.targets('hosts_vc_0', plan.HOST_NTP),
+                         ['esx-1', 'esx-2', 'esx-3'])
+        self.assertEqual(vc_plan.targets('hosts_vc_0', plan.HOST_RULE),
+                         ['esx-2', 'esx-3'])
+        settings = vc_plan.host_settings('hosts_vc_0')
+        self.assertEqual(settings['esx-2']['services'], ['ssh'])
+        self.assertEqual(settings['esx-1']['services'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from common import inventory
+from common import operations
+from common import session
+from common import task
+from common import utils
+
+
+class SessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.real_dir = utils.SESSION_CACHE_DIR
+        utils.SESSION_CACHE_DIR = os.path.join(self.cache_dir, 'sessions')
+
+    def tearDown(self):
+        utils.SESSION_CACHE_DIR = self.real_dir
+        shutil.rmtree(self.cache_dir)
+
+    def test_round_trip(self):
+        self.assertIsNone(session.load_cookie('vc', 'admin'))
+        session.save_cookie('vc', 'admin', 'vmware_soap_session="1"')
+        self.assertEqual(session.load_cookie('vc', 'admin'),
+                         'vmware_soap_session="1"')
+        self.assertIsNone(session.load_cookie('vc', 'other'))
+        path = session._get_cache_file('vc', 'admin')
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0600)
+        session.clear_cookie('vc', 'admin')
+        session.clear_cookie('vc', 'admin')
+        self.assertIsNone(session.load_cookie('vc', 'admin'))
+
+
+class FakeView(object):
+
+    def __init__(self):
+        self.destroyed = False
+
+    def DestroyView(self):
+        self.destroyed = True
+
+
+class FakeDestroyable(object):
+
+    def __init__(self):
+        self.destroyed = False
+
+    def Destroy(self):
+        self.destroyed = True
+
+    destroy = Destroy
+
+
+class FakeServiceInstance(object):
+
+    def __init__(self):
+        self._stub = object()
+
+    def RetrieveContent(self):
+        raise AssertionError('releasing must not log out')
+
+
+class ReleaseTest(unittest.TestCase):
+
+    def get_vc(self):
+        vc = operations.get_vcenter('vc', 'admin', 'pwd', reuse_session=True)
+        vc.si = FakeServiceInstance()
+        self.view = FakeView()
+        inventory.get_view_manager(vc.si).views[('root', ())] = self.view
+        self.watcher = FakeDestroyable()
+        task._taskWatchers[vc.si._stub] = self.watcher
+        self.index = FakeDestroyable()
+        vc.index = self.index
+        inventory.register_index(vc.si, self.index)
+        return vc
+
+    def test_release_keeps_session(self):
+        vc = self.get_vc()
+        operations.release_sessions()
+        self.assertTrue(self.view.destroyed)
+        self.assertTrue(self.watcher.destroyed)
+        self.assertTrue(self.index.destroyed)
+        self.assertIsNotNone(vc.si)
+        self.assertEqual(vc.open_views(), 0)
+        self.assertIsNone(inventory.get_index(vc.si))
+        self.assertNotIn(vc.si._stub, task._taskWatchers)
+        self.assertEqual(operations._reused_vcs, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
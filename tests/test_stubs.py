@@ -0,0 +1,235 @@
+import os
+import shutil
+import tempfile
+import unittest
+from common import stubs
+
+VERSION = 'vim.version.version6'
+
+
+class Fault(Exception):
+    pass
+
+
+class FakeSoapStub(object):
+    """Answers like SoapStubAdapter: a (status, obj) pair for an outer
+    stub, obj or a raised fault otherwise.
+    """
+
+    def __init__(self, results, cookie=None):
+        self.version = VERSION
+        self.cookie = cookie
+        self.results = results
+        self.outer_stubs = []
+
+    def InvokeMethod(self, mo, info, args, outerStub=None):
+        outerStub = outerStub or self
+        self.outer_stubs.append(outerStub)
+        status, obj = self.results.pop(0)
+        if outerStub is not self:
+            return status, obj
+        if status == 200:
+            return obj
+        raise obj
+
+
+class Info(object):
+
+    def __init__(self, wsdl_name):
+        self.wsdlName = wsdl_name
+
+
+CALL = Info('RetrieveContent')
+POLL = Info('WaitForUpdatesEx')
+
+
+class PooledStubTest(unittest.TestCase):
+
+    def get_stub(self, results, size=2):
+        self.created = []
+
+        def create_stub():
+            stub = FakeSoapStub(results)
+            self.created.append(stub)
+            return stub
+        return stubs.PooledStub(create_stub, size)
+
+    def test_returns_result(self):
+        pooled = self.get_stub([(200, 'content')])
+        self.assertEqual(pooled.InvokeMethod(None, CALL, []), 'content')
+        self.assertEqual(self.created[0].outer_stubs, [pooled])
+
+    def test_raises_fault(self):
+        pooled = self.get_stub([(500, Fault('denied'))])
+        self.assertRaises(Fault, pooled.InvokeMethod, None, CALL, [])
+
+    def test_returns_pair_to_outer_stub(self):
+        pooled = self.get_stub([(500, Fault('denied'))])
+        outer = object()
+        status, obj = pooled.InvokeMethod(None, CALL, [], outer)
+        self.assertEqual(status, 500)
+        self.assertIsInstance(obj, Fault)
+        self.assertEqual(self.created[0].outer_stubs, [outer])
+
+    def test_shares_new_cookie(self):
+        pooled = self.get_stub([(200, None)])
+        first = self.created[0]
+
+        def login(mo, info, args, outerStub=None):
+            first.cookie = 'session'
+            return 200, None
+        first.InvokeMethod = login
+        pooled.InvokeMethod(None, CALL, [])
+        self.assertEqual(pooled.cookie, 'session')
+        held = [pooled._acquire(), pooled._acquire()]
+        second = self.created[1]
+        self.assertEqual(held, [first, second])
+        pooled._release(first)
+        pooled._release(second)
+        pooled.InvokeMethod(None, CALL, [])
+        self.assertEqual(second.outer_stubs, [pooled])
+        self.assertEqual(second.cookie, 'session')
+
+    def test_bounds_stubs(self):
+        pooled = self.get_stub([(200, None)] * 4, size=2)
+        held = [pooled._acquire(), pooled._acquire()]
+        self.assertEqual(len(self.created), 2)
+        for stub in held:
+            pooled._release(stub)
+        pooled.InvokeMethod(None, CALL, [])
+        self.assertEqual(len(self.created), 2)
+
+    def test_long_polls_outside_pool(self):
+        pooled = self.get_stub([(200, None)] * 3, size=1)
+        held = pooled._acquire()
+        # The only pool stub is busy, the long poll does not wait for it
+        pooled.InvokeMethod(None, POLL, [])
+        pooled.InvokeMethod(None, POLL, [])
+        self.assertEqual(len(self.created), 2)
+        self.assertEqual(self.created[1].outer_stubs, [pooled, pooled])
+        pooled._release(held)
+        pooled.InvokeMethod(None, CALL, [])
+        self.assertEqual(held.outer_stubs, [pooled])
+
+
+class FakeClock(object):
+    """Stands in for the time module of stubs"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.real_time = stubs.time
+        stubs.time = self.clock
+
+    def tearDown(self):
+        stubs.time = self.real_time
+
+    def test_borrow(self):
+        bucket = stubs.TokenBucket(2, burst=4)
+        self.assertEqual(bucket._borrow(4.0, 0, 0), (3.0, 0.0))
+        # Empty bucket: the token is borrowed, half a second at 2/s
+        self.assertEqual(bucket._borrow(0.0, 0, 0), (-1.0, 0.5))
+        self.assertEqual(bucket._borrow(-1.0, 0, 0), (-2.0, 1.0))
+        # Refill is capped at the burst
+        self.assertEqual(bucket._borrow(0.0, 0, 100), (3.0, 0.0))
+        # A clock going back does not drain the bucket
+        self.assertEqual(bucket._borrow(2.0, 10, 5), (1.0, 0.0))
+
+    def test_burst_then_rate(self):
+        bucket = stubs.TokenBucket(10)
+        for i in range(10):
+            self.assertEqual(bucket.take(), 0.0)
+        self.assertEqual(self.clock.slept, [])
+        waits = [bucket.take() for i in range(5)]
+        for wait in waits:
+            self.assertAlmostEqual(wait, 0.1)
+        self.assertAlmostEqual(self.clock.now, 1000.5)
+
+    def test_refills_while_idle(self):
+        bucket = stubs.TokenBucket(1, burst=2)
+        bucket.take()
+        bucket.take()
+        self.clock.now += 1.5
+        self.assertEqual(bucket.take(), 0.0)
+        self.assertAlmostEqual(bucket.take(), 0.5)
+
+    def test_shared_bucket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'rates', 'vc.calls.2')
+        self.addCleanup(shutil.rmtree, os.path.dirname(os.path.dirname(path)))
+        first = stubs.SharedTokenBucket(path, 2)
+        second = stubs.SharedTokenBucket(path, 2)
+        self.assertEqual(first.take(), 0.0)
+        self.assertEqual(second.take(), 0.0)
+        # Both took from the same file
+        self.assertAlmostEqual(first.take(), 0.5)
+        self.assertAlmostEqual(second.take(), 0.5)
+
+
+class RateLimitedStubTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.real_time = stubs.time
+        stubs.time = self.clock
+        stubs._buckets.clear()
+
+    def tearDown(self):
+        stubs.time = self.real_time
+        stubs._buckets.clear()
+
+    def test_unpacks_result(self):
+        inner = FakeSoapStub([(200, 'content'), (500, Fault('denied'))])
+        stub = stubs.RateLimitedStub(inner, stubs.RateLimit(10), 'vc')
+        self.assertEqual(stub.InvokeMethod(None, Info('Retrieve'), []),
+                         'content')
+        self.assertRaises(Fault, stub.InvokeMethod, None, Info('Destroy'),
+                          [])
+        self.assertEqual(inner.outer_stubs, [stub, stub])
+
+    def test_stacked_on_pooled_stub(self):
+        pooled = stubs.PooledStub(
+            lambda: FakeSoapStub([(200, 'content'), (500, Fault('x'))]))
+        stub = stubs.RateLimitedStub(pooled, stubs.RateLimit(10), 'vc')
+        self.assertEqual(stub.InvokeMethod(None, Info('Retrieve'), []),
+                         'content')
+        self.assertRaises(Fault, stub.InvokeMethod, None, Info('Retrieve'),
+                          [])
+
+    def test_task_budget(self):
+        inner = FakeSoapStub([(200, None)] * 4)
+        stub = stubs.RateLimitedStub(inner, stubs.RateLimit(100, 1), 'vc')
+        stub.InvokeMethod(None, Info('PowerOffVM_Task'), [])
+        stub.InvokeMethod(None, Info('RetrieveContents'), [])
+        stub.InvokeMethod(None, Info('Destroy_Task'), [])
+        stats = stub.stats()
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['tasks'], 2)
+        self.assertEqual(stats['delayed'], 1)
+        self.assertAlmostEqual(stats['waited'], 1.0)
+
+    def test_buckets_per_vcenter_and_rate(self):
+        limit = stubs.RateLimit(5)
+        self.assertIs(limit.get_bucket('vc1', 'calls'),
+                      stubs.RateLimit(5).get_bucket('vc1', 'calls'))
+        self.assertIsNot(limit.get_bucket('vc1', 'calls'),
+                         limit.get_bucket('vc2', 'calls'))
+        self.assertIsNot(limit.get_bucket('vc1', 'calls'),
+                         stubs.RateLimit(6).get_bucket('vc1', 'calls'))
+        self.assertIsNone(limit.get_bucket('vc1', 'tasks'))
+
+
+if __name__ == '__main__':
+    unittest.main()
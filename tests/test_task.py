@@ -0,0 +1,74 @@
+import socket
+import time
+import unittest
+from pyVmomi import vim
+from common import task
+from tests.fakes import FakeServiceInstance, get_update, modify
+
+
+def get_task_update(version, vim_task, state):
+    return get_update(version, modify(vim_task, ('info.state', state)))
+
+
+class TaskWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.si = FakeServiceInstance()
+        self.watcher = task.TaskWatcher(self.si)
+        self.watcher.RETRY_SECONDS = 0.01
+        self.watcher.MAX_RETRY_SECONDS = 0.02
+        self.addCleanup(self.watcher.Destroy)
+        self.vim_task = vim.Task('task-1')
+
+    def test_completes(self):
+        future = self.watcher.Watch(self.vim_task)
+        self.si.pc.Push(get_task_update('1', self.vim_task, 'success'))
+        self.assertEqual(future.Wait(5), 'success')
+        self.assertIn(self.vim_task, self.si.view_stub.added)
+
+    def test_result_from_change_set(self):
+        pg = vim.dvs.DistributedVirtualPortgroup('dvportgroup-1')
+        update = get_update('1', modify(self.vim_task,
+                                        ('info.state', 'success'),
+                                        ('info.result', [pg])))
+        future = self.watcher.Watch(self.vim_task)
+        self.si.pc.Push(update)
+        self.assertEqual(future.Wait(5), 'success')
+        self.assertEqual(future.result, [pg])
+
+    def test_retries_transient_errors(self):
+        self.si.pc.Push(get_task_update('1', vim.Task('task-0'), 'running'))
+        future = self.watcher.Watch(self.vim_task)
+        self.si.pc.Push(socket.error('connection reset'))
+        self.si.pc.Push(socket.timeout('timed out'))
+        self.si.pc.Push(get_task_update('2', self.vim_task, 'error'))
+        self.assertEqual(future.Wait(5), 'error')
+        # The version of the last update is kept over the failed polls
+        versions = self.si.pc.versions
+        self.assertEqual(versions[:4], ['', '1', '1', '1'])
+
+    def test_aborts_when_unreachable(self):
+        self.watcher.MAX_FAILURE_SECONDS = 0.05
+        future = self.watcher.Watch(self.vim_task)
+        for i in range(20):
+            self.si.pc.Push(socket.error('connection refused'))
+        self.assertRaises(socket.error, future.Wait, 5)
+
+    def test_aborts_when_not_authenticated(self):
+        future = self.watcher.Watch(self.vim_task)
+        self.si.pc.Push(vim.fault.NotAuthenticated())
+        self.assertRaises(vim.fault.NotAuthenticated, future.Wait, 5)
+        self.assertIn(self.vim_task, self.si.view_stub.removed)
+
+    def test_destroy(self):
+        future = self.watcher.Watch(self.vim_task)
+        self.watcher.Destroy()
+        self.assertRaises(task.TaskWatcherDestroyed, future.Wait, 5)
+        deadline = time.time() + 5
+        while self.watcher.thread is not None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(self.watcher.thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+from common import thumbprint
+from common import utils
+
+
+class ThumbprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        real_file = utils.THUMBPRINT_CACHE_FILE
+        utils.THUMBPRINT_CACHE_FILE = os.path.join(self.dir, 'cache',
+                                                   'thumbprints.json')
+        self.addCleanup(setattr, utils, 'THUMBPRINT_CACHE_FILE', real_file)
+        self.fetched = []
+        self.reachable = {'esx-1': 'AA:01', 'esx-2': 'AA:02'}
+        real_fetch = thumbprint.fetch_thumbprint
+        thumbprint.fetch_thumbprint = self.fetch
+        self.addCleanup(setattr, thumbprint, 'fetch_thumbprint', real_fetch)
+
+    def fetch(self, host_name, timeout):
+        self.fetched.append(host_name)
+        return self.reachable.get(host_name)
+
+    def test_cache(self):
+        self.assertEqual(thumbprint.get_thumbprints(
+            ['esx-1', 'esx-2', 'esx-1', 'esx-3']),
+            {'esx-1': 'AA:01', 'esx-2': 'AA:02', 'esx-3': None})
+        self.assertEqual(sorted(self.fetched), ['esx-1', 'esx-2', 'esx-3'])
+        # Unreachable hosts are not cached
+        del self.fetched[:]
+        self.assertEqual(thumbprint.get_thumbprint('esx-1'), 'AA:01')
+        self.assertIsNone(thumbprint.get_thumbprint('esx-3'))
+        self.assertEqual(self.fetched, ['esx-3'])
+
+    def test_does_not_wait_for_idle_workers(self):
+        start = time.time()
+        thumbprint.get_thumbprint('esx-1')
+        thumbprint.get_thumbprints(['esx-1', 'esx-2'], refresh=True)
+        self.assertLess(time.time() - start, 2)
+
+    def test_refresh(self):
+        thumbprint.get_thumbprint('esx-1')
+        self.reachable['esx-1'] = 'BB:01'
+        self.assertEqual(thumbprint.get_thumbprint('esx-1'), 'AA:01')
+        self.assertEqual(thumbprint.get_thumbprint('esx-1', refresh=True),
+                         'BB:01')
+        self.assertEqual(thumbprint.get_thumbprint('esx-1'), 'BB:01')
+        self.assertEqual(self.fetched, ['esx-1', 'esx-1'])
+
+
+class FetchThumbprintTest(unittest.TestCase):
+
+    def test_unreachable_host(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.assertIsNone(thumbprint.fetch_thumbprint('127.0.0.1', port, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()